@@ -0,0 +1,64 @@
+"""Benchmark the storage backends of the Historian
+
+Compares the write throughput of every backend and the time taken to read
+back a whole session and a short time range of it. Run from the top
+directory of the repository with
+
+    PYTHONPATH=. python benchmarks/bench_storage.py
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
+
+# Import NumPy first, so that its import is not timed as a read
+import numpy  # noqa: F401
+from tclab.tagdb import TagDB
+from tclab.storage import MemoryStorage, BinaryStorage
+
+tags = ['T1', 'T2', 'Q1', 'Q2']
+
+
+def backends(directory):
+    return [('TagDB (WAL, 100 rows)',
+             lambda: TagDB(os.path.join(directory, 'bench.db'))),
+            ('MemoryStorage', MemoryStorage),
+            ('BinaryStorage',
+             lambda: BinaryStorage(os.path.join(directory, 'sessions')))]
+
+
+def bench(storage, nrows, repeat=20):
+    storage.new_session()
+    tic = time.perf_counter()
+    for i in range(nrows):
+        storage.record_row(i, tags, [21.5, 22.5, 50, 0])
+    storage.flush()
+    write = nrows / (time.perf_counter() - tic)
+    tic = time.perf_counter()
+    storage.get_session(tags)
+    full = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for k in range(repeat):
+        t = k * nrows // repeat
+        storage.get_session(tags, None, t, t + 60)
+    window = (time.perf_counter() - tic) / repeat
+    storage.close()
+    return write, full, window
+
+
+def main(nrows=20000):
+    directory = tempfile.mkdtemp()
+    try:
+        print('{:24s} {:>12s} {:>14s} {:>14s}'.format(
+            '', 'write', 'read session', 'read 60 s'))
+        for description, create in backends(directory):
+            write, full, window = bench(create(), nrows)
+            print('{:24s} {:8.0f} rows/s {:11.2f} ms {:11.3f} ms'.format(
+                description, write, 1000 * full, 1000 * window))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark TagDB write throughput
+
+Compares the old TagDB, which inserted and committed every value in a
+tagvalues table of its own, with the current TagDB writing rows of all
+tags at one time, committed one by one or in buffered batches. Every
+configuration records the same values, and the throughput is reported in
+values per second. Run from the top directory of the repository with
+
+    PYTHONPATH=. python benchmarks/bench_tagdb.py
+"""
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from tclab.tagdb import TagDB
+
+configurations = [
+    ('one row per time, rollback journal, FULL',
+     dict(buffersize=1, journal_mode='DELETE', synchronous='FULL')),
+    ('one row per time, WAL, NORMAL',
+     dict(buffersize=1)),
+    ('buffered (100 rows), WAL, NORMAL',
+     dict()),
+    ('buffered (1000 rows), WAL, NORMAL',
+     dict(buffersize=1000, flushinterval=10)),
+]
+
+tags = ['T1', 'T2', 'Q1', 'Q2']
+
+
+def baseline_values_per_second(filename, nvalues):
+    """Insert and commit every value on its own, as the old TagDB did"""
+    db = sqlite3.connect(filename)
+    db.execute("""CREATE TABLE tagvalues (session_id, timeseconds,
+                                          name, value)""")
+    db.commit()
+    tic = time.perf_counter()
+    for i in range(nvalues // len(tags)):
+        for tag in tags:
+            db.execute("INSERT INTO tagvalues VALUES (?, ?, ?, ?)",
+                       (1, i, tag, 21.5))
+            db.commit()
+    toc = time.perf_counter()
+    db.close()
+    return nvalues / (toc - tic)
+
+
+def values_per_second(filename, nvalues, **options):
+    db = TagDB(filename, **options)
+    db.new_session()
+    tic = time.perf_counter()
+    for i in range(nvalues // len(tags)):
+        for tag in tags:
+            db.record(i, tag, 21.5)
+    db.flush()
+    toc = time.perf_counter()
+    db.close()
+    return nvalues / (toc - tic)
+
+
+def main(nvalues=2000):
+    directory = tempfile.mkdtemp()
+    try:
+        rate = baseline_values_per_second(
+            os.path.join(directory, 'baseline.db'), nvalues)
+        print('{:42s} {:12.0f} values/s'.format(
+            'old TagDB, commit per value', rate))
+        for i, (description, options) in enumerate(configurations):
+            filename = os.path.join(directory, 'bench{}.db'.format(i))
+            rate = values_per_second(filename, nvalues, **options)
+            print('{:42s} {:12.0f} values/s'.format(description, rate))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,23 @@
+import sys
+
 from .tclab import TCLab, TCLabModel, diagnose
 from .historian import Historian, Plotter
+from .compression import Deadband, SwingingDoor
+from .storage import MemoryStorage, BinaryStorage
+from .derived import (EMA, RollingMean, RollingVariance, Derivative, Integral,
+                      RunningMin, RunningMax)
+from .alarms import High, Low, Rate, Stuck, Invalid
 from .experiment import Experiment, runexperiment
-from .labtime import clock, labtime, setnow
+from .labtime import clock, labtime, setnow, Labtime
+from .labtime import labtime as _labtime
+from .scheduler import Scheduler
 from .version import __version__
 
+if sys.version_info >= (3, 5):
+    from .aio import aclock, asubscribe
+
 
-def setup(connected=True, speedup=1):
+def setup(connected=True, speedup=1, labtime=None):
     """Set up a lab session with simple switching between real and model lab
 
     The idea of this function is that you will do
@@ -26,6 +38,10 @@ def setup(connected=True, speedup=1):
 
     will run the lab clock at twice real time (which means that the whole
     simulation will take half the time it would if connected to a real device).
+
+    The speedup is set on labtime, which defaults to the module-level
+    labtime shared by the labs, clocks and historians which are not given
+    their own Labtime.
     """
 
     if connected:
@@ -38,5 +54,7 @@ def setup(connected=True, speedup=1):
             raise ValueError('speedup must be positive. '
                              'You passed speedup={}'.format(speedup))
 
+    if labtime is None:
+        labtime = _labtime
     labtime.set_rate(speedup)
     return lab
@@ -0,0 +1,118 @@
+"""asyncio versions of the labtime functions and Historian subscriptions
+
+These need Python 3.5 or later and are only imported into the tclab package
+when they are available.
+"""
+import asyncio
+
+from .historian import Subscription
+from .labtime import Clock, labtime as default_labtime
+
+
+async def sleep(labtime, delay):
+    """Sleep in labtime for a period delay without blocking the event loop.
+
+    Virtual labtime is advanced straight away, after which control is passed
+    back to the event loop once so that other tasks can run."""
+    if labtime.virtual or not labtime.running:
+        labtime.sleep(delay)
+        await asyncio.sleep(0)
+    else:
+        labtime.lastsleep = delay
+        await asyncio.sleep(delay / labtime.get_rate())
+
+
+class AsyncClock(Clock):
+    """Asynchronous iterator providing labtime values in sync with real time.
+
+    This behaves like `Clock`, including the synchronisation checks, the
+    adaptive rate and the lateness statistics, but waits for each tick with
+    `asyncio.sleep` so that many clocks can share one event loop. The spin
+    option is not available because it would block the event loop.
+    """
+    def __init__(self, labtime, period, step=1, tol=float('inf'),
+                 adaptive=True, slack=0.5):
+        super().__init__(labtime, period, step, tol, adaptive, slack=slack)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            if self._started():
+                self._check()
+                deadline = self._deadline()
+                await sleep(self.labtime, self._delay(deadline))
+                self._arrive(deadline)
+            return self._current()
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def aclock(period, step=1, tol=float('inf'), adaptive=True, slack=0.5,
+           labtime=None):
+    """Asynchronous equivalent of `clock` for use in asyncio control loops
+
+    >>> async def control(lab):
+    ...     async for t in aclock(20):
+    ...         lab.Q1(100 if t < 10 else 0)
+
+    labtime defaults to the module-level labtime. Pass a separate Labtime to
+    each loop to run several labs independently in one event loop.
+    """
+    if labtime is None:
+        labtime = default_labtime
+    return AsyncClock(labtime, period, step, tol, adaptive, slack)
+
+
+class AsyncSubscription(Subscription):
+    """Subscription to a Historian which is an asynchronous iterator
+
+    Rows logged by `Historian.update`, in the event loop or in another
+    thread, are buffered as for `Subscription` and returned by `async for`.
+    """
+    def __init__(self, historian, columns=None, maxlen=1000, loop=None):
+        super().__init__(historian, None, columns, maxlen)
+        if loop is None:
+            # get_running_loop is new in Python 3.7
+            loop = getattr(asyncio, 'get_running_loop',
+                           asyncio.get_event_loop)()
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def _wake(self):
+        if not self.event.is_set():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def _deliver(self, row):
+        super()._deliver(row)
+        self._wake()
+
+    def close(self):
+        super().close()
+        self._wake()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.buffer:
+            if self.closed:
+                raise StopAsyncIteration
+            self.event.clear()
+            if self.buffer or self.closed:
+                continue
+            await self.event.wait()
+        return self.buffer.popleft()
+
+
+def asubscribe(historian, columns=None, maxlen=1000):
+    """Return an asynchronous iterator over the rows logged by historian
+
+    >>> async def show(historian):
+    ...     async for t, T1 in asubscribe(historian, ['Time', 'T1']):
+    ...         print(t, T1)
+
+    Must be called from a coroutine running in the event loop.
+    """
+    return historian._add(AsyncSubscription(historian, columns, maxlen))
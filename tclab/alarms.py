@@ -0,0 +1,127 @@
+"""Alarm rules for the Historian
+
+An alarm rule watches the values of one column, its `tag`, and is either
+active or not. Rules see one value at a time through `add(t, value)`, which
+returns True when the alarm is raised, False when it clears and None when
+its state does not change. Every rule only keeps a few numbers of state,
+so checking a value takes constant time. `reset` clears the alarm and
+forgets the values seen.
+
+Limit rules have a `deadband`: once raised, the alarm only clears when
+the value is back within the limit by more than the deadband, so that a
+value hovering around the limit does not raise the alarm again and again.
+
+Values which are not numbers, like None, do not change the state of the
+rules, except for `Invalid`, which is raised by them.
+"""
+from __future__ import division
+
+from .compression import _isnumber
+
+
+class Rule(object):
+    """Base of the alarm rules
+
+    Derived classes implement `check(t, value)`, returning whether the
+    alarm should be active for a value which is a number."""
+    kind = 'alarm'
+
+    def __init__(self, tag, name=None):
+        self.tag = tag
+        self.name = name or '{} {}'.format(tag, self.kind)
+        self.reset()
+
+    def reset(self):
+        self.active = False
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        active = self.check(t, value)
+        if active == self.active:
+            return None
+        self.active = active
+        return active
+
+    def check(self, t, value):
+        raise NotImplementedError
+
+
+class High(Rule):
+    """Active while the value is above limit"""
+    kind = 'high'
+
+    def __init__(self, tag, limit, deadband=0, name=None):
+        if deadband < 0:
+            raise ValueError('deadband must not be negative.')
+        self.limit = limit
+        self.deadband = deadband
+        Rule.__init__(self, tag, name)
+
+    def check(self, t, value):
+        if self.active:
+            return value > self.limit - self.deadband
+        return value > self.limit
+
+
+class Low(High):
+    """Active while the value is below limit"""
+    kind = 'low'
+
+    def check(self, t, value):
+        if self.active:
+            return value < self.limit + self.deadband
+        return value < self.limit
+
+
+class Rate(High):
+    """Active while the value changes faster than limit per second, in
+    either direction"""
+    kind = 'rate'
+
+    def reset(self):
+        High.reset(self)
+        self.last = None
+
+    def check(self, t, value):
+        last, self.last = self.last, (t, value)
+        if last is None or t == last[0]:
+            return self.active
+        return High.check(self, t, abs(value - last[1]) / (t - last[0]))
+
+
+class Stuck(Rule):
+    """Active when the value has not changed by more than tolerance for
+    at least seconds, as from a sensor which has stopped responding"""
+    kind = 'stuck'
+
+    def __init__(self, tag, seconds, tolerance=0, name=None):
+        if seconds <= 0:
+            raise ValueError('seconds must be positive.')
+        self.seconds = seconds
+        self.tolerance = tolerance
+        Rule.__init__(self, tag, name)
+
+    def reset(self):
+        Rule.reset(self)
+        self.reference = None
+
+    def check(self, t, value):
+        reference = self.reference
+        if reference is None or abs(value - reference[1]) > self.tolerance:
+            self.reference = (t, value)
+            return False
+        return t - reference[0] >= self.seconds
+
+
+class Invalid(Rule):
+    """Active while the value is not a number, like the None recorded for
+    a source which timed out"""
+    kind = 'invalid'
+
+    def add(self, t, value):
+        active = not _isnumber(value)
+        if active == self.active:
+            return None
+        self.active = active
+        return active
@@ -0,0 +1,233 @@
+"""Column storage for the Historian
+
+The Historian stores every column in something that behaves like a list
+and supports append. ArrayColumn keeps the values in a NumPy array instead
+of a list of Python floats. CompressedColumn only keeps the values archived
+by a compression policy and reconstructs the others when they are read.
+"""
+from __future__ import division
+
+import bisect
+
+
+class ArrayColumn(object):
+    """A column of floats stored in a NumPy array
+
+    Without a capacity, the array starts with room for `initial` values and
+    doubles in size whenever it is full. With a capacity, the column is a
+    ring buffer which keeps only the last `capacity` values. Every value is
+    stored twice in an array of twice the capacity, so that the values kept
+    are always contiguous and indexing or slicing the column returns a view
+    into the array without copying.
+
+    Views show the values in place: a view of a ring buffer changes when the
+    values it shows are overwritten, and a view taken before the column
+    grows does not show later values. Take a copy of a view which needs to
+    be kept around.
+    """
+    def __init__(self, capacity=None, initial=1024):
+        import numpy
+        self.capacity = capacity
+        if capacity is None:
+            self.data = numpy.empty(initial)
+        else:
+            if capacity < 1:
+                raise ValueError('capacity must be at least 1')
+            self.data = numpy.empty(2 * capacity)
+        self.head = 0
+        self.n = 0
+
+    def append(self, value):
+        if value is None:
+            value = float('nan')
+        capacity = self.capacity
+        if capacity is None:
+            if self.n == len(self.data):
+                self._grow()
+            self.data[self.n] = value
+            self.n += 1
+        else:
+            position = (self.head + self.n) % capacity
+            self.data[position] = self.data[position + capacity] = value
+            if self.n < capacity:
+                self.n += 1
+            else:
+                self.head = (self.head + 1) % capacity
+
+    def _grow(self):
+        import numpy
+        data = numpy.empty(max(2 * len(self.data), 1))
+        data[:self.n] = self.data[:self.n]
+        self.data = data
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def set_array(self, values):
+        """Make the column show the values of a 1D array without copying.
+
+        The array may be read-only, like a memory-mapped file: the values
+        are only copied when the column grows. Not possible for a ring
+        buffer."""
+        if self.capacity is not None:
+            raise ValueError('Cannot set the array of a ring buffer')
+        self.data = values
+        self.head = 0
+        self.n = len(values)
+
+    def view(self):
+        """Return a NumPy view of the values in the column"""
+        return self.data[self.head:self.head + self.n]
+
+    def bisect(self, value):
+        """Equivalent of bisect.bisect for a sorted column"""
+        return int(self.view().searchsorted(value, side='right'))
+
+    def __array__(self, dtype=None, copy=None):
+        view = self.view()
+        return view if dtype is None else view.astype(dtype)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __repr__(self):
+        return 'ArrayColumn({!r})'.format(self.view())
+
+
+class CompressedColumn(object):
+    """A column which only stores the values archived by a compression policy
+
+    The column has a value for every time in the Time column `times`. The
+    values which were not archived by the policy (see tclab.compression) are
+    reconstructed from the archived points, using the interpolation of the
+    policy. The last value is kept until the policy decides whether to
+    archive it. If `times` is a ring buffer, archived points before the
+    values still in it are dropped.
+    """
+    def __init__(self, times, policy):
+        self.times = times
+        self.policy = policy
+        policy.reset()
+        self.archivetimes = []
+        self.archivevalues = []
+        self.last = None
+        self.lastarchived = False
+
+    def append(self, value):
+        """Add the value at the last time in `times`.
+
+        Returns the decision of the policy, whether the previous and whether
+        this value were archived."""
+        t = self.times[-1]
+        previous, current = self.policy.add(t, value)
+        if previous:
+            self._archive(*self.last)
+        if current:
+            self._archive(t, value)
+        self.last = (t, value)
+        self.lastarchived = current
+        return previous, current
+
+    def close(self):
+        """Archive the last value if the policy needs it at the end.
+
+        Returns True if the last value was archived."""
+        if self.policy.close() and not self.lastarchived:
+            self._archive(*self.last)
+            self.lastarchived = True
+            return True
+        return False
+
+    def restore(self, value):
+        """Add a value read back from storage at the last time in `times`.
+
+        None marks a value which was not archived."""
+        if value is not None:
+            self._archive(self.times[-1], value)
+        self.last = (self.times[-1], value)
+        self.lastarchived = True
+
+    def _archive(self, t, value):
+        times = self.archivetimes
+        times.append(t)
+        self.archivevalues.append(value)
+        capacity = getattr(self.times, 'capacity', None)
+        if capacity is not None and len(times) > 2 * capacity:
+            drop = bisect.bisect(times, self.times[0]) - 1
+            del times[:drop]
+            del self.archivevalues[:drop]
+
+    def at(self, t):
+        """Return the reconstructed value at time t"""
+        times, values = self.archivetimes, self.archivevalues
+        i = bisect.bisect(times, t)
+        if i == 0:
+            return None
+        t0, v0 = times[i - 1], values[i - 1]
+        if self.policy.interpolation == 'previous' or t0 == t:
+            return v0
+        if i < len(times):
+            t1, v1 = times[i], values[i]
+        elif not self.lastarchived and self.last[0] > t0:
+            t1, v1 = self.last
+        else:
+            return v0
+        if v0 is None or v1 is None:
+            return v0
+        return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+    def at_array(self, times):
+        """Return a NumPy array of the reconstructed values at times
+
+        Values which are not numbers are returned as nan."""
+        import numpy
+        ts, values = list(self.archivetimes), list(self.archivevalues)
+        linear = self.policy.interpolation == 'linear'
+        if (linear and ts and not self.lastarchived
+                and self.last[0] > ts[-1]):
+            ts.append(self.last[0])
+            values.append(self.last[1])
+        ts = numpy.array(ts, dtype=float)
+        values = numpy.array(values, dtype=float)
+        times = numpy.asarray(times, dtype=float)
+        if not len(ts):
+            return numpy.full(times.shape, numpy.nan)
+        index = numpy.searchsorted(ts, times, side='right') - 1
+        if linear:
+            result = numpy.interp(times, ts, values)
+        else:
+            result = values[numpy.maximum(index, 0)]
+        result[index < 0] = numpy.nan
+        return result
+
+    def _values(self, times):
+        if isinstance(self.times, list):
+            return [self.at(t) for t in times]
+        return self.at_array(times)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._values(self.times)
+        import numpy
+        return numpy.asarray(values, dtype=float if dtype is None else dtype)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._values(self.times[key])
+        return self.at(self.times[key])
+
+    def __iter__(self):
+        return iter(self._values(self.times))
+
+    def __repr__(self):
+        return 'CompressedColumn({}, {} archived)'.format(
+            type(self.policy).__name__, len(self.archivetimes))
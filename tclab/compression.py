@@ -0,0 +1,111 @@
+"""Compression policies for the Historian
+
+A compression policy decides which of the values of a tag need to be
+archived so that all values can be reconstructed within a tolerance.
+Policies see one value at a time through `add`, which returns a pair of
+booleans: whether the previous value and whether this value should be
+archived. `close` returns whether the last value should be archived when
+recording stops. `interpolation` is the method used to reconstruct the
+values which were not archived, 'previous' or 'linear'.
+
+Values which are not numbers, like None, are always archived.
+"""
+from __future__ import division
+
+import math
+import numbers
+
+
+def _isnumber(value):
+    return (isinstance(value, numbers.Real) and not isinstance(value, bool)
+            and not math.isnan(value))
+
+
+class Deadband(object):
+    """Exception deadband compression
+
+    A value is archived when it differs by more than `tolerance` from the
+    last archived value. The values in between are within `tolerance` of the
+    archived value before them."""
+    interpolation = 'previous'
+
+    def __init__(self, tolerance):
+        if tolerance < 0:
+            raise ValueError('tolerance must not be negative.')
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self.archived = None
+        self.lastarchived = None
+
+    def add(self, t, value):
+        archive = (self.lastarchived is None or not _isnumber(value)
+                   or not _isnumber(self.archived)
+                   or abs(value - self.archived) > self.tolerance)
+        if archive:
+            self.archived = value
+        self.lastarchived = archive
+        return False, archive
+
+    def close(self):
+        last = self.lastarchived is False
+        self.reset()
+        return last
+
+
+class SwingingDoor(object):
+    """Swinging door compression
+
+    The values between two archived points are within `tolerance` of the
+    straight line joining the points. Starting from the last archived point,
+    the slopes of the lines passing within `tolerance` of every value since
+    are narrowed down to a range, the door. When the line to a new value no
+    longer fits through the door, the previous value is archived and a new
+    door is started from there."""
+    interpolation = 'linear'
+
+    def __init__(self, tolerance):
+        if tolerance < 0:
+            raise ValueError('tolerance must not be negative.')
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self._restart(None)
+
+    def _restart(self, point):
+        """Start a new door from an archived point"""
+        self.archived = point
+        self.low = -float('inf')
+        self.high = float('inf')
+
+    def _narrow(self, t, value):
+        """Narrow the door by the tolerance band around value at t"""
+        ta, va = self.archived
+        self.low = max(self.low, (value - self.tolerance - va) / (t - ta))
+        self.high = min(self.high, (value + self.tolerance - va) / (t - ta))
+
+    def add(self, t, value):
+        last, self.last = self.last, (t, value)
+        if last is None:
+            self._restart(self.last)
+            return False, True
+        previous = self.archived is not last
+        ta, va = self.archived
+        if not (_isnumber(value) and _isnumber(va) and t > last[0]):
+            self._restart(self.last)
+            return previous, True
+        if self.low <= (value - va) / (t - ta) <= self.high:
+            self._narrow(t, value)
+            return False, False
+        # the line to value does not fit through the door
+        self._restart(last)
+        self._narrow(t, value)
+        return True, False
+
+    def close(self):
+        last = self.last is not None and self.archived is not self.last
+        self.reset()
+        return last
@@ -0,0 +1,198 @@
+"""Derived tags for the Historian
+
+A derived tag calculates a value from the values of another column, its
+`source`, every time the Historian updates. The value is stored in a
+column like the values of sources. Derived tags see one value at a time
+through `add(t, value)`, which returns the derived value and takes a
+constant time (amortised for the windowed tags), so they never look back
+through the columns. `reset` forgets all values seen.
+
+Windowed tags cover the last `n` values or the values of the last
+`seconds` seconds, including the current one. Without either, they cover
+all values.
+
+Values which are not numbers, like None, are skipped: the derived value is
+then None and the state is not changed.
+"""
+from __future__ import division
+
+from collections import deque
+import math
+
+from .compression import _isnumber
+
+
+class EMA(object):
+    """Exponential moving average
+
+    With `alpha`, every value gets the weight alpha. With a time constant
+    `tau` in seconds, the weight depends on the time since the last value,
+    so that irregular updates are averaged correctly."""
+    def __init__(self, source, alpha=None, tau=None):
+        if (alpha is None) == (tau is None):
+            raise ValueError('Give one of alpha or tau.')
+        if alpha is not None and not 0 < alpha <= 1:
+            raise ValueError('alpha must be between 0 and 1.')
+        if tau is not None and tau <= 0:
+            raise ValueError('tau must be positive.')
+        self.source = source
+        self.alpha = alpha
+        self.tau = tau
+        self.reset()
+
+    def reset(self):
+        self.t = None
+        self.value = None
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        if self.value is None:
+            self.value = value
+        else:
+            alpha = self.alpha
+            if alpha is None:
+                alpha = 1 - math.exp(-(t - self.t) / self.tau)
+            self.value += alpha * (value - self.value)
+        self.t = t
+        return self.value
+
+
+class Derivative(object):
+    """Rate of change between the last two values, per second"""
+    def __init__(self, source):
+        self.source = source
+        self.reset()
+
+    def reset(self):
+        self.last = None
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        last, self.last = self.last, (t, value)
+        if last is None or t == last[0]:
+            return None
+        return (value - last[1]) / (t - last[0])
+
+
+class Integral(object):
+    """Integral over time by the trapezoidal rule, starting at `initial`"""
+    def __init__(self, source, initial=0):
+        self.source = source
+        self.initial = initial
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.value = self.initial
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        if self.last is not None:
+            t0, v0 = self.last
+            self.value += (t - t0) * (v0 + value) / 2
+        self.last = (t, value)
+        return self.value
+
+
+class _Windowed(object):
+    """Base of the tags over a window of the last n values or seconds"""
+    def __init__(self, source, n=None, seconds=None):
+        if n is not None and seconds is not None:
+            raise ValueError('Give at most one of n or seconds.')
+        if n is not None and n < 1:
+            raise ValueError('n must be at least 1.')
+        if seconds is not None and seconds <= 0:
+            raise ValueError('seconds must be positive.')
+        self.source = source
+        self.n = n
+        self.seconds = seconds
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+
+    def _expired(self, index, t, tnow):
+        """Whether value number index, at time t, is out of the window
+        ending with the current value at time tnow"""
+        if self.n is not None:
+            return index <= self.count - self.n
+        return self.seconds is not None and t <= tnow - self.seconds
+
+
+class RollingMean(_Windowed):
+    """Mean of the values in a window"""
+    def reset(self):
+        _Windowed.reset(self)
+        self.window = deque()
+        self.times = deque()
+        self.mean = 0
+        self.m2 = 0
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        self.count += 1
+        self.times.append(t)
+        self.window.append(value)
+        k = len(self.window)
+        delta = value - self.mean
+        self.mean += delta / k
+        self.m2 += delta * (value - self.mean)
+        while self._expired(self.count - k + 1, self.times[0], t):
+            self.times.popleft()
+            old = self.window.popleft()
+            k -= 1
+            delta = old - self.mean
+            self.mean -= delta / k
+            self.m2 -= delta * (old - self.mean)
+        return self.result()
+
+    def result(self):
+        return self.mean
+
+
+class RollingVariance(RollingMean):
+    """Variance of the values in a window
+
+    The variance is divided by the number of values minus `ddof`, as in
+    numpy.var, and is None until there are more than ddof values."""
+    def __init__(self, source, n=None, seconds=None, ddof=0):
+        self.ddof = ddof
+        RollingMean.__init__(self, source, n, seconds)
+
+    def result(self):
+        k = len(self.window)
+        if k <= self.ddof:
+            return None
+        return max(self.m2, 0) / (k - self.ddof)
+
+
+class RunningMax(_Windowed):
+    """Largest value in a window"""
+    def _better(self, a, b):
+        return a >= b
+
+    def reset(self):
+        _Windowed.reset(self)
+        self.candidates = deque()
+
+    def add(self, t, value):
+        if not _isnumber(value):
+            return None
+        self.count += 1
+        candidates = self.candidates
+        while candidates and self._better(value, candidates[-1][2]):
+            candidates.pop()
+        candidates.append((self.count, t, value))
+        while self._expired(candidates[0][0], candidates[0][1], t):
+            candidates.popleft()
+        return candidates[0][2]
+
+
+class RunningMin(RunningMax):
+    """Smallest value in a window"""
+    def _better(self, a, b):
+        return a <= b
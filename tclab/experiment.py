@@ -1,6 +1,6 @@
 from .tclab import TCLab, TCLabModel
 from .historian import Historian, Plotter
-from .labtime import labtime, clock
+from .labtime import labtime as default_labtime
 
 
 class Experiment:
@@ -27,7 +27,8 @@ class Experiment:
     def __init__(self, connected=True, plot=True,
                  twindow=200, time=500,
                  dbfile=':memory:',
-                 speedup=1, synced=True, tol=0.5):
+                 speedup=1, synced=True, tol=0.5, virtual=False,
+                 labtime=None):
         """Parameters:
         connected: If True, connect to a physical TCLab, if False, connecte to
                    TCLabModel
@@ -39,8 +40,15 @@ class Experiment:
         synced: Try to run at a fixed factor of real time. If this is False, run
                 as fast as possible regardless of the value of speedup.
         tol: Clock tolerance (used for experiment.clock)
+        virtual: Run the experiment on virtual labtime, which jumps straight
+                 to the next clock tick instead of waiting for it. The
+                 simulation then runs as fast as possible while the lab,
+                 historian and clock still see consistent times.
+        labtime: The Labtime shared by the lab, historian and clock. Defaults
+                 to the module-level labtime. Pass a separate Labtime to run
+                 several experiments in one process without interfering.
         """
-        if (speedup != 1 or not synced) and connected:
+        if (speedup != 1 or not synced or virtual) and connected:
             raise ValueError('The real TCLab can only run real time.')
 
         self.connected = connected
@@ -51,19 +59,26 @@ class Experiment:
         self.speedup = speedup
         self.synced = synced
         self.tol = tol
+        self.virtual = virtual
+        self.labtime = default_labtime if labtime is None else labtime
+        self._was_virtual = self.labtime.virtual
         if synced:
-            labtime.set_rate(speedup)
+            self.labtime.set_rate(speedup)
 
         self.lab = None
         self.historian = None
         self.plotter = None
 
     def __enter__(self):
+        if self.virtual:
+            self._was_virtual = self.labtime.virtual
+            self.labtime.set_virtual(True)
         if self.connected:
-            self.lab = TCLab()
+            self.lab = TCLab(labtime=self.labtime)
         else:
-            self.lab = TCLabModel(synced=self.synced)
-        self.historian = Historian(self.lab.sources, dbfile=self.dbfile)
+            self.lab = TCLabModel(synced=self.synced, labtime=self.labtime)
+        self.historian = Historian(self.lab.sources, dbfile=self.dbfile,
+                                   labtime=self.labtime)
         if self.plot:
             self.plotter = Plotter(self.historian, twindow=self.twindow)
 
@@ -72,10 +87,12 @@ class Experiment:
     def __exit__(self, exc_type, exc_value, traceback):
         self.lab.close()
         self.historian.close()
+        if self.virtual:
+            self.labtime.set_virtual(self._was_virtual)
 
     def clock(self):
         if self.synced:
-            times = clock(self.time, tol=self.tol)
+            times = self.labtime.clock(self.time, tol=self.tol)
         else:
             times = range(self.time)
         for t in times:
@@ -0,0 +1,84 @@
+"""Streaming export of Historian data
+
+The writers take the rows or arrays to write from iterators, so that data
+read from a TagDB in chunks is written without holding all of it in memory.
+"""
+import csv
+import gzip
+import os
+import sys
+import tempfile
+import zipfile
+
+# ZipFile.open can write members from Python 3.6
+_stream_members = sys.version_info >= (3, 6)
+
+
+def write_csv(filename, header, rows):
+    """Write rows to a CSV file, compressed with gzip if filename ends
+    with .gz"""
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'wt' if sys.version_info[0] > 2 else 'wb')
+    else:
+        f = open(filename, 'w')
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_npy(f, shape, chunks):
+    """Write a 2D array of floats in .npy format to the open file f.
+
+    The rows of the array are taken from chunks, an iterable of 2D arrays,
+    until shape[0] rows have been written. Raises ValueError if there are
+    not enough rows."""
+    import numpy
+    from numpy.lib import format
+    dtype = numpy.dtype('<f8')
+    format.write_array_header_1_0(f, {'descr': format.dtype_to_descr(dtype),
+                                      'fortran_order': False,
+                                      'shape': tuple(shape)})
+    remaining = shape[0]
+    for chunk in chunks:
+        if remaining <= 0:
+            break
+        chunk = numpy.asarray(chunk, dtype=dtype)[:remaining]
+        f.write(chunk.tobytes())
+        remaining -= len(chunk)
+    if remaining > 0:
+        raise ValueError('{} rows of the array are missing.'.format(
+            remaining))
+
+
+def write_npz(filename, arrays, compressed=False):
+    """Write arrays to a NumPy .npz file.
+
+    arrays is a list of (name, array) or (name, shape, chunks) tuples. The
+    latter are written with `write_npy` one chunk at a time."""
+    import numpy
+    compression = zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED
+    with zipfile.ZipFile(filename, 'w', compression) as archive:
+        for item in arrays:
+            if len(item) == 2:
+                def write(f, array=numpy.asarray(item[1])):
+                    numpy.lib.format.write_array(f, array)
+            else:
+                def write(f, item=item):
+                    write_npy(f, item[1], item[2])
+            _write_member(archive, item[0] + '.npy', write)
+
+
+def _write_member(archive, name, write):
+    """Add a member to a zip archive, written by write(f)"""
+    if _stream_members:
+        with archive.open(name, 'w', force_zip64=True) as f:
+            write(f)
+        return
+    f = tempfile.NamedTemporaryFile(suffix='.npy', delete=False)
+    try:
+        with f:
+            write(f)
+        archive.write(f.name, name)
+    finally:
+        os.remove(f.name)
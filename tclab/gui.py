@@ -5,7 +5,7 @@ import tornado
 
 from .tclab import TCLab, TCLabModel
 from .historian import Historian, Plotter
-from .labtime import labtime, clock
+from .labtime import labtime as default_labtime
 
 from ipywidgets import Button, Label, FloatSlider, HBox, VBox, Checkbox,\
     IntText
@@ -133,7 +133,8 @@ class SimpleInteraction(NotebookInteraction):
 
 
 class NotebookUI:
-    def __init__(self, Controller=SimpleInteraction):
+    def __init__(self, Controller=SimpleInteraction, labtime=None):
+        self.labtime = default_labtime if labtime is None else labtime
         self.timer = tornado.ioloop.PeriodicCallback(self.update, 1000)
         self.lab = None
         self.plotter = None
@@ -170,11 +171,11 @@ class NotebookUI:
     def update(self):
         """Update GUI display."""
         self.timer.callback_time = 1000/self.speedup.value
-        labtime.set_rate(self.speedup.value)
+        self.labtime.set_rate(self.speedup.value)
 
-        self.timewidget.value = '{:.2f}'.format(labtime.time())
-        self.controller.update(labtime.time())
-        self.plotter.update(labtime.time())
+        self.timewidget.value = '{:.2f}'.format(self.labtime.time())
+        self.controller.update(self.labtime.time())
+        self.plotter.update(self.labtime.time())
 
     def togglemodel(self, change):
         """Speedup can only be enabled when working with the model"""
@@ -194,13 +195,13 @@ class NotebookUI:
 
         self.controller.start()
         self.timer.start()
-        labtime.reset()
-        labtime.start()
+        self.labtime.reset()
+        self.labtime.start()
 
     def action_stop(self, widget):
         """Stop TCLab operation."""
         self.timer.stop()
-        labtime.stop()
+        self.labtime.stop()
 
         self.start.disabled = False
         self.stop.disabled = True
@@ -210,14 +211,15 @@ class NotebookUI:
     def action_connect(self, widget):
         """Connect to TCLab."""
         if self.usemodel.value:
-            self.lab = TCLabModel()
+            self.lab = TCLabModel(labtime=self.labtime)
         else:
-            self.lab = TCLab()
-        labtime.stop()
-        labtime.reset()
+            self.lab = TCLab(labtime=self.labtime)
+        self.labtime.stop()
+        self.labtime.reset()
 
         self.controller.connect(self.lab)
-        self.historian = Historian(self.controller.sources)
+        self.historian = Historian(self.controller.sources,
+                                   labtime=self.labtime)
         self.plotter = Plotter(self.historian,
                                twindow=500,
                                layout=self.controller.layout)
@@ -4,88 +4,393 @@
 from __future__ import print_function
 from __future__ import division
 import bisect
-import sqlite3
-from .labtime import labtime
+from collections import deque, OrderedDict
+import copy
+import math
+import threading
+from .labtime import labtime as default_labtime, realtime
+from .tagdb import TagDB, BackgroundWriter
 import time
 
 
-class TagDB:
-    """Interface to sqlite database containing tag values"""
-    def __init__(self, filename=":memory:"):
-        """Create or connect to a database
-
-        :param filename: The filename of the database.
-                         By default, values are stored in memory."""
-        self.db = sqlite3.connect(filename)
-        self.cursor = self.db.cursor()
-        creates = ["""CREATE TABLE IF NOT EXISTS tagvalues (
-                           session_id REFERENCES session (id),
-                           timeseconds, name, value)""",
-                   """CREATE TABLE IF NOT EXISTS sessions (
-                           id INTEGER PRIMARY KEY,
-                           starttime)"""]
-        for statement in creates:
-            self.cursor.execute(statement)
-        self.db.commit()
+class _Resampler(object):
+    """Resample rows of sessions arriving in chunks onto a grid of times
+    relative to the first row of each session"""
+    def __init__(self, grid, ncolumns, method):
+        import numpy
+        self.grid = numpy.asarray(grid, dtype=float)
+        self.ncolumns = ncolumns
+        self.method = method
+        self.data = {}
         self.session = None
 
-    def new_session(self):
-        self.cursor.execute("""INSERT INTO SESSIONS (starttime)
-                               VALUES (datetime('now'))""")
-        self.session = self.cursor.lastrowid
-        self.db.commit()
+    def add(self, session, times, values):
+        """Add the rows of one session, which follow any added before"""
+        import numpy
+        grid = self.grid
+        if session != self.session:
+            self.finish()
+            self.session = session
+            self.offset = times[0]
+            self.last = None
+            self.filled = 0
+            self.out = numpy.full((len(grid), self.ncolumns), numpy.nan)
+            self.data[session] = self.out
+        times = numpy.asarray(times, dtype=float) - self.offset
+        values = numpy.array(values, dtype=float).reshape(len(times), -1)
+        if self.last is not None:
+            times = numpy.concatenate([[self.last[0]], times])
+            values = numpy.vstack([self.last[1], values])
+        stop = int(grid.searchsorted(times[-1]))
+        points = grid[self.filled:stop]
+        if self.method == 'linear':
+            for c in range(self.ncolumns):
+                self.out[self.filled:stop, c] = numpy.interp(
+                    points, times, values[:, c])
+        else:
+            index = numpy.maximum(
+                times.searchsorted(points, side='right') - 1, 0)
+            self.out[self.filled:stop] = values[index]
+        self.filled = stop
+        self.last = (times[-1], values[-1])
 
-    def get_sessions(self):
-        query = """SELECT id, starttime, COUNT(DISTINCT timeseconds) 
-                   FROM sessions LEFT JOIN tagvalues ON sessions.id=session_id
-                   GROUP BY id ORDER BY starttime"""
-        return list(self.cursor.execute(query))
-
-    def delete_session(self, session_id):
-        queries = ['DELETE FROM sessions WHERE id = ?',
-                   'DELETE FROM tagvalues WHERE session_id = ?']
-        for query in queries:
-            self.cursor.execute(query, (session_id,))
-        self.db.commit()
-
-    def record(self, timeseconds, name, value):
-        if self.session is None:
-            self.new_session()
-        self.cursor.execute("INSERT INTO tagvalues VALUES (?, ?, ?, ?)",
-                            (self.session, timeseconds, name, value))
-        self.db.commit()
-
-    def get(self, name, timeseconds=None, session=None):
-        if session is None:
-            session = self.session
-        query = """SELECT timeseconds, value FROM tagvalues
-                   WHERE session_id=? AND name=?"""
-        parameters = [session, name]
-        if timeseconds is not None:
-            query += " and timeseconds=?"
-            parameters.append(timeseconds)
-        query += " ORDER BY timeseconds"
-        return list(self.cursor.execute(query, parameters))
-
-    def clean(self):
-        """Delete sessions with no associated points"""
-        query = """DELETE FROM sessions WHERE id NOT IN 
-                   (SELECT DISTINCT session_id FROM tagvalues)"""
-        self.cursor.execute(query)
-        self.db.commit()
+    def finish(self):
+        """Fill the grid after the last row of the current session"""
+        if self.session is not None:
+            self.out[self.filled:] = self.last[1]
+
+
+class _Reconstructor(object):
+    """Fill in the values of compressed columns in rows of one session
+    arriving in chunks
+
+    interpolations gives the interpolation of the policy of every value in
+    the rows after Time, or None for columns which are not compressed. A
+    None in a compressed column was not archived, and is reconstructed like
+    `CompressedColumn.at` does from the archived points around it. Rows
+    waiting for the next archived point of a linear column are held back,
+    so `add` may return fewer rows than it was given. `finish` returns the
+    rows still held back at the end of the session."""
+    def __init__(self, interpolations):
+        self.columns = [(i + 1, method)
+                        for i, method in enumerate(interpolations) if method]
+        self.last = {}
+        self.waiting = {}
+        self.pending = deque()
+
+    def add(self, rows):
+        done = []
+        for row in rows:
+            entry = [list(row), 0]
+            values = entry[0]
+            t = values[0]
+            for i, method in self.columns:
+                value = values[i]
+                last = self.last.get(i)
+                if value is None:
+                    if last is None:
+                        continue
+                    if method == 'previous':
+                        values[i] = last[1]
+                    else:
+                        self.waiting.setdefault(i, []).append(entry)
+                        entry[1] += 1
+                    continue
+                for held in self.waiting.pop(i, []):
+                    t0, v0 = last
+                    held[0][i] = v0 + (value - v0) * (held[0][0] - t0) / (
+                        t - t0)
+                    held[1] -= 1
+                self.last[i] = (t, value)
+            self.pending.append(entry)
+            while self.pending and not self.pending[0][1]:
+                done.append(tuple(self.pending.popleft()[0]))
+        return done
+
+    def finish(self):
+        for i, entries in self.waiting.items():
+            for values, _ in entries:
+                values[i] = self.last[i][1]
+        self.waiting = {}
+        done = [tuple(values) for values, _ in self.pending]
+        self.pending.clear()
+        return done
+
+
+class Subscription(object):
+    """Rows delivered by a Historian to a consumer as they are logged
+
+    Create subscriptions with `Historian.subscribe`. With a callback, every
+    row is passed to the callback from `Historian.update`. Otherwise rows
+    are kept in a buffer of at most maxlen rows, from which the consumer
+    takes them by iterating over the subscription, possibly in another
+    thread, or with `drain`. When the buffer is full, the oldest row is
+    dropped and counted in `dropped`, so a slow consumer never holds up
+    `update`. Exceptions raised by the callback are counted in `errors`
+    and the last one is kept in `error`, so a broken consumer never stops
+    `update` or the other subscriptions.
+
+    Rows are tuples of the values of the subscribed columns. Closing the
+    Historian closes its subscriptions.
+    """
+    def __init__(self, historian, callback=None, columns=None, maxlen=1000):
+        self.historian = historian
+        self.callback = callback
+        self.columns = historian.columns if columns is None else columns
+        self.indices = [historian.columns.index(c) for c in self.columns]
+        self.buffer = deque(maxlen=maxlen)
+        self.condition = threading.Condition()
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.error = None
+        self.closed = False
+
+    def _deliver(self, row):
+        values = tuple(row[i] for i in self.indices)
+        self.delivered += 1
+        if self.callback is not None:
+            try:
+                self.callback(values)
+            except Exception as error:
+                self.errors += 1
+                self.error = error
+            return
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(values)
+            self.condition.notify()
+
+    def drain(self):
+        """Return the buffered rows and empty the buffer"""
+        with self.condition:
+            rows = list(self.buffer)
+            self.buffer.clear()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Return the next row, waiting for it if necessary.
+
+        Stops once the subscription is closed and the buffer is empty."""
+        with self.condition:
+            while not self.buffer:
+                if self.closed:
+                    raise StopIteration
+                self.condition.wait()
+            return self.buffer.popleft()
+
+    next = __next__
 
     def close(self):
-        self.clean()
-        self.db.close()
+        """Stop receiving rows"""
+        self.historian.unsubscribe(self)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SessionView(object):
+    """Read-only view of a session which reads pages from the TagDB
+
+    The view supports timeslice, at and after like a Historian which has
+    loaded the session, without loading it. Rows are read in pages of
+    pagewidth seconds of time as they are needed, and the cachesize pages
+    used most recently are kept. When rows are added to the session, the
+    pages from the previous last time onwards are read again.
+
+    Compressed columns, with policies given by compression, are
+    reconstructed from the values archived in the session as by
+    load_session. The archived values of these columns are read whole.
+    """
+    def __init__(self, db, session, columns=None, pagewidth=100,
+                 cachesize=32, compression=None):
+        self.db = db
+        self.session = session
+        if columns is None:
+            columns = ['Time'] + db.session_summary(session)['tags']
+        self.columns = list(columns)
+        self.pagewidth = pagewidth
+        self.cachesize = cachesize
+        self.compression = dict(compression or {})
+        self.pages = OrderedDict()
+        self.archives = {}
+        self.summary = None
+        self.reads = 0
+
+    def _summary(self):
+        """Return the summary of the session, dropping the pages and
+        archives which rows added since the last call may have changed"""
+        summary = self.db.session_summary(self.session)
+        previous = self.summary
+        if previous is not None and (summary['rows'], summary['tlast']) != (
+                previous['rows'], previous['tlast']):
+            if previous['tlast'] is not None:
+                first = int(math.floor(previous['tlast'] / self.pagewidth))
+                for k in [k for k in self.pages if k >= first]:
+                    del self.pages[k]
+            self.archives = {}
+        self.summary = summary
+        return summary
+
+    def _archive(self, name):
+        """Return a CompressedColumn with the archived values of a column"""
+        column = self.archives.get(name)
+        if column is None:
+            from .columns import CompressedColumn
+            times = []
+            column = CompressedColumn(times,
+                                      copy.copy(self.compression[name]))
+            for t, value in self.db.get(name, session=self.session):
+                times.append(t)
+                column.restore(value)
+            self.archives[name] = column
+        return column
+
+    def _page(self, k):
+        """Return the times and rows of page k"""
+        page = self.pages.pop(k, None)
+        if page is None:
+            rows = self.db.get_session(self.columns[1:], self.session,
+                                       k * self.pagewidth,
+                                       (k + 1) * self.pagewidth)
+            page = ([row[0] for row in rows], rows)
+            self.reads += 1
+            if len(self.pages) >= self.cachesize:
+                self.pages.popitem(last=False)
+        self.pages[k] = page
+        return page
+
+    def _rows(self, tfirst, tlast):
+        """Return the times and rows from tfirst to tlast"""
+        times, rows = [], []
+        first = int(math.floor(tfirst / self.pagewidth))
+        last = int(math.floor(tlast / self.pagewidth))
+        for k in range(first, last + 1):
+            pagetimes, pagerows = self._page(k)
+            times.extend(pagetimes)
+            rows.extend(pagerows)
+        return times, rows
+
+    def timeslice(self, tstart=0, tend=None, columns=None):
+        if columns is None:
+            columns = self.columns
+        indices = [self.columns.index(c) for c in columns]
+        summary = self._summary()
+        if not summary['rows']:
+            return [[] for _ in columns]
+        tfirst = self.db.last_time(tstart, self.session)
+        before = tfirst is None
+        if before:
+            tfirst = summary['tfirst']
+        if tend is None or tend == tstart:
+            tlast = summary['tlast'] if tend is None else tfirst
+        else:
+            tlast = self.db.last_time(tend, self.session)
+            if tlast is None:
+                tlast = summary['tfirst']
+        times, rows = self._rows(tfirst, max(tfirst, tlast))
+        start = 0 if before else bisect.bisect(times, tfirst) - 1
+        if tend is not None and tend == tstart:
+            stop = start + 1
+        else:
+            stop = bisect.bisect(times, tlast)
+        rows = rows[start:stop]
+        result = []
+        for c, i in zip(columns, indices):
+            if c in self.compression:
+                archive = self._archive(c)
+                result.append([archive.at(row[0]) for row in rows])
+            else:
+                result.append([row[i] for row in rows])
+        return result
+
+    def at(self, t, columns=None):
+        """ Return the values of columns at or just before a certain time
+
+        Compressed columns are reconstructed at t itself, as by
+        Historian.at."""
+        if columns is None:
+            columns = self.columns
+        values = [c[0] for c in self.timeslice(t, t, columns)]
+        summary = self.summary
+        for i, c in enumerate(columns):
+            if c in self.compression:
+                tc = min(max(t, summary['tfirst']), summary['tlast'])
+                values[i] = self._archive(c).at(tc)
+        return values
+
+    def after(self, t, columns=None):
+        """ Return the values of columns after or just before a certain time"""
+        return self.timeslice(t, columns=columns)
 
 
 class Historian(object):
     """Generalised logging class"""
-    def __init__(self, sources, dbfile=":memory:"):
+    def __init__(self, sources, dbfile=":memory:", labtime=None,
+                 arrays=False, capacity=None,
+                 background=False, queuesize=1000, overflow='block',
+                 compression=None, readers=0, parallel=False, timeout=None,
+                 timestamps=False, storage=None, derived=(), alarms=()):
         """
         sources: an iterable of (name, callable) tuples
             - name (str) is the name of a signal and the
             - callable is evaluated to obtain the value.
+        dbfile: the TagDB file to record to, or None for no database.
+        labtime: the Labtime used for implicit update times. Defaults to the
+            module-level labtime.
+        arrays: store the columns in NumPy arrays (see ArrayColumn) instead
+            of lists. The values must then be numbers, and slices returned
+            by timeslice and after are views into the arrays.
+        capacity: only keep the last capacity values of every column in
+            memory. Implies arrays. All values are still recorded in the
+            database.
+        background: write to the database on a separate thread (see
+            BackgroundWriter), so that update never waits for the disk.
+        queuesize, overflow: the size of the queue of rows waiting to be
+            written in the background and what to do when it is full:
+            'block', 'drop' the oldest row or 'spill' to a temporary file.
+        compression: a dictionary of compression policies by name, like
+            {'T1': SwingingDoor(0.1)} (see tclab.compression). Only the
+            values archived by the policy are kept in memory (see
+            CompressedColumn) and recorded in the database, the others are
+            reconstructed within the tolerance of the policy when read.
+        readers: the number of read-only connections the TagDB may open, so
+            that other threads can query it while the Historian records.
+            With background, these queries see the rows already written.
+        parallel: call the source callables concurrently on a thread pool,
+            so that an update takes as long as the slowest source instead
+            of all of them together. Use this for sources which wait for
+            different devices.
+        timeout: with parallel, the longest time in seconds to wait for a
+            source. Sources which take longer are recorded as None and
+            counted in timeouts, and are not called again until their
+            last call has returned. The result of that call is dropped,
+            so every row only holds values acquired for its update.
+        storage: a storage backend to record to instead of a TagDB, like
+            MemoryStorage or BinaryStorage (see tclab.storage). dbfile is
+            then ignored.
+
+        timestamps: add columns <name>.start and <name>.end after the
+            others, with the labtime at which each source callable was
+            called and returned. name is the first name of the callable.
+        derived: an iterable of (name, tag) tuples of derived tags, like
+            [('T1.ema', EMA('T1', tau=10))] (see tclab.derived). They are
+            calculated from the values of their source column at every
+            update and stored in columns after the others. A source may
+            be an earlier derived tag.
+        alarms: an iterable of alarm rules, like [High('T1', 60)] (see
+            tclab.alarms), checked against the values of every update.
+            Every time an alarm is raised or cleared, an event (time,
+            name, active, value) is added to events and recorded in the
+            database. active_alarms returns the alarms which are active.
+
+        The labtime at which the value of every source was obtained by the
+        last update is kept in acquisition, and `latency_statistics`
+        summarises how long each source callable takes.
 
         Example:
 
@@ -116,53 +421,272 @@ class Historian(object):
         [(0, 1, 2)]
 
         """
+        self.labtime = default_labtime if labtime is None else labtime
+        self.arrays = arrays or capacity is not None
+        self.capacity = capacity
         self.sources = [('Time', lambda: self.tnow)] + list(sources)
-        if dbfile:
-            self.db = TagDB(dbfile)
+        if storage is not None:
+            if background:
+                raise ValueError('background needs a TagDB, not a storage.')
+            self.db = storage
+            self.db.new_session()
+            self.session = self.db.session
+        elif dbfile:
+            if background:
+                self.db = BackgroundWriter(dbfile, queuesize, overflow,
+                                           readers=readers)
+            else:
+                self.db = TagDB(dbfile, readers=readers)
             self.db.new_session()
             self.session = self.db.session
         else:
             self.db = None
             self.session = 1
 
-        self.tstart = labtime.time()
+        self.tstart = self.labtime.time()
 
         self.columns = [name for name, _ in self.sources]
 
+        self.groups = []
+        for name, valuefunction in self.sources[1:]:
+            if valuefunction:
+                self.groups.append(([name], valuefunction))
+            elif self.groups:
+                self.groups[-1][0].append(name)
+            else:
+                raise ValueError('The first source needs a callable')
+        if timestamps:
+            for names, _ in self.groups:
+                self.columns += [names[0] + '.start', names[0] + '.end']
+        self.timestamps = timestamps
+        self.derived = []
+        for name, tag in derived:
+            if name in self.columns:
+                raise ValueError('Duplicate column {}'.format(name))
+            if tag.source not in self.columns[1:]:
+                raise ValueError('Unknown source {} of derived tag {}'.format(
+                    tag.source, name))
+            self.derived.append((self.columns.index(tag.source), tag))
+            self.columns.append(name)
+        self.alarms = []
+        for rule in alarms:
+            if rule.tag not in self.columns[1:]:
+                raise ValueError('Unknown tag {} of alarm {}'.format(
+                    rule.tag, rule.name))
+            self.alarms.append((self.columns.index(rule.tag), rule))
+        self.acquisition = {}
+        self.latency = {names[0]: [0, 0, 0, 0, None]
+                        for names, _ in self.groups}
+        self.timeouts = {name: 0 for name, _ in self.sources[1:]}
+        if timeout is not None and not parallel:
+            raise ValueError('timeout needs parallel')
+        self.timeout = timeout
+        if parallel:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max(len(self.groups), 1))
+            self.running = [None] * len(self.groups)
+        else:
+            self.executor = None
+
+        self.compression = dict(compression or {})
+        unknown = set(self.compression) - set(self.columns[1:])
+        if unknown:
+            raise ValueError('Cannot compress unknown columns {}'.format(
+                sorted(unknown)))
+        self.compressed = [i for i, name in enumerate(self.columns)
+                           if name in self.compression]
+        self.held = None
+        self.subscriptions = []
+
         self.build_fields()
 
     def build_fields(self):
-        self.fields = [[] for _ in self.columns]
+        if self.arrays:
+            from .columns import ArrayColumn
+            self.fields = [ArrayColumn(self.capacity) for _ in self.columns]
+        else:
+            self.fields = [[] for _ in self.columns]
+        if self.compressed:
+            from .columns import CompressedColumn
+            for i in self.compressed:
+                policy = self.compression[self.columns[i]]
+                self.fields[i] = CompressedColumn(self.fields[0], policy)
         self.logdict = dict(zip(self.columns, self.fields))
         self.t = self.logdict['Time']
+        for _, tag in self.derived:
+            tag.reset()
+        for _, rule in self.alarms:
+            rule.reset()
+        self.events = []
 
     def update(self, tnow=None):
         if tnow is None:
-            self.tnow = labtime.time() - self.tstart
+            self.tnow = self.labtime.time() - self.tstart
         else:
             self.tnow = tnow
 
-        for name, valuefunction in self.sources:
-            if valuefunction:
-                v = valuefunction()
-                try:
-                    values = iter(v)
-                except TypeError:
-                    values = iter([v])
+        row = [self.tnow]
+        stamps = []
+        for (names, _), result in zip(self.groups, self._acquire()):
+            v, start, end, latency = result
+            stamps += [start, end]
+            if latency is not None:
+                self._latency(names[0], latency)
             try:
-                value = next(values)
-            except StopIteration:
-                raise ValueError("valuefunction did not return enough values")
+                values = iter(v)
+            except TypeError:
+                values = iter([v])
+            for name in names:
+                try:
+                    row.append(next(values))
+                except StopIteration:
+                    raise ValueError(
+                        "valuefunction did not return enough values")
+                self.acquisition[name] = end
+        if self.timestamps:
+            row += stamps
+        for i, tag in self.derived:
+            row.append(tag.add(self.tnow, row[i]))
+        for i, rule in self.alarms:
+            active = rule.add(self.tnow, row[i])
+            if active is not None:
+                self._event(rule.name, active, row[i])
+
+        decisions = [field.append(value)
+                     for field, value in zip(self.fields, row)]
+        if self.compressed:
+            if self.db:
+                self._record(row, decisions)
+        elif self.db:
+            self.db.record_row(self.tnow, self.columns[1:], row[1:])
+        for subscription in self.subscriptions:
+            subscription._deliver(row)
 
-            self.logdict[name].append(value)
-            if self.db and name != "Time":
-                self.db.record(self.tnow, name, value)
+    def _event(self, name, active, value):
+        event = (self.tnow, name, active, value)
+        self.events.append(event)
+        if self.db:
+            self.db.record_event(*event)
+
+    def active_alarms(self):
+        """Return the names of the alarms which are active"""
+        return [rule.name for _, rule in self.alarms if rule.active]
+
+    def _call(self, valuefunction):
+        """Return the value of a source, the labtimes before and after
+        calling it and the real time the call took"""
+        real = realtime()
+        start = self.labtime.time() - self.tstart
+        v = valuefunction()
+        end = self.labtime.time() - self.tstart
+        return v, start, end, realtime() - real
+
+    def _latency(self, name, latency):
+        """Add the duration of a call to the statistics of a source"""
+        statistics = self.latency[name]
+        statistics[0] += 1
+        delta = latency - statistics[1]
+        statistics[1] += delta / statistics[0]
+        statistics[2] += delta * (latency - statistics[1])
+        statistics[3] = max(statistics[3], latency)
+        statistics[4] = latency
+
+    def latency_statistics(self):
+        """Return a dictionary summarising the real time taken by each
+        source callable, by the first name of the callable.
+
+        For each source, calls is the number of calls which returned, and
+        mean, std, max and last describe how long they took in seconds."""
+        result = {}
+        for name, (n, mean, m2, worst, last) in self.latency.items():
+            result[name] = {'calls': n,
+                            'mean': mean,
+                            'std': math.sqrt(m2 / n) if n else 0,
+                            'max': worst,
+                            'last': last}
+        return result
+
+    def _acquire(self):
+        """Return the value and acquisition time of every group of sources"""
+        if self.executor is None:
+            return [self._call(valuefunction)
+                    for _, valuefunction in self.groups]
+        from concurrent.futures import wait
+        futures = []
+        for i, (_, valuefunction) in enumerate(self.groups):
+            future = self.running[i]
+            if future is None or future.done():
+                # the result of a call which timed out is dropped
+                future = self.executor.submit(self._call, valuefunction)
+                self.running[i] = future
+                futures.append(future)
+            else:
+                futures.append(None)
+        wait([future for future in futures if future is not None],
+             self.timeout)
+        results = []
+        for i, ((names, _), future) in enumerate(zip(self.groups, futures)):
+            if future is not None and future.done():
+                self.running[i] = None
+                results.append(future.result())
+            else:
+                for name in names:
+                    self.timeouts[name] += 1
+                results.append(([None] * len(names), None, None, None))
+        return results
+
+    def subscribe(self, callback=None, columns=None, maxlen=1000):
+        """Return a Subscription receiving every row logged from now on
+
+        callback is called with each row, otherwise the rows are buffered,
+        keeping at most maxlen of them. columns defaults to all columns."""
+        return self._add(Subscription(self, callback, columns, maxlen))
+
+    def _add(self, subscription):
+        # replaced rather than changed, so update never sees it change
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions = [s for s in self.subscriptions
+                              if s is not subscription]
+
+    def _record(self, row, decisions):
+        """Record a row with the values archived by compression.
+
+        Swinging door compression decides whether to archive a value at the
+        next update, so each row is held back until then."""
+        if self.held is not None:
+            heldrow, archived = self.held
+            for i in self.compressed:
+                archived[i] = archived[i] or decisions[i][0]
+            self._write(heldrow, archived)
+        self.held = (row, {i: decisions[i][1] for i in self.compressed})
+
+    def _write(self, row, archived):
+        values = [None if archived.get(i) is False else value
+                  for i, value in enumerate(row)]
+        if any(value is not None for value in values[1:]):
+            self.db.record_row(row[0], self.columns[1:], values[1:])
+
+    def _finish(self):
+        """Archive the last values of compressed columns and write the
+        held row"""
+        for i in self.compressed:
+            closed = self.fields[i].close()
+            if self.held is not None and closed:
+                self.held[1][i] = True
+        if self.held is not None:
+            self._write(*self.held)
+            self.held = None
 
     @property
     def log(self):
         return list(zip(*[self.logdict[c] for c in self.columns]))
 
     def timeindex(self, t):
+        if self.arrays:
+            return max(self.t.bisect(t) - 1, 0)
         return max(bisect.bisect(self.t, t) - 1, 0)
 
     def timeslice(self, tstart=0, tend=None, columns=None):
@@ -170,20 +694,85 @@ class Historian(object):
         if tend is None:
             stop = len(self.t) + 1
         # Ensure that we always return at least one time's value
-        if tend == tstart:
+        elif tend == tstart:
             stop = start + 1
+        else:
+            stop = self.timeindex(tend) + 1
         if columns is None:
             columns = self.columns
         return [self.logdict[c][start:stop] for c in columns]
 
     def at(self, t, columns=None):
-        """ Return the values of columns at or just before a certain time"""
-        return [c[0] for c in self.timeslice(t, t, columns)]
+        """ Return the values of columns at or just before a certain time
+
+        t can also be a sequence of times, in which case an array of values
+        is returned for every column (see interp). Compressed columns are
+        reconstructed at t itself, within the logged times, since the rows
+        of a loaded session only exist at the times values were archived."""
+        if hasattr(t, '__len__'):
+            return self.interp(t, columns)
+        if columns is None:
+            columns = self.columns
+        values = [c[0] for c in self.timeslice(t, t, columns)]
+        if self.compressed and len(self.t):
+            tc = min(max(t, self.t[0]), self.t[-1])
+            for i, c in enumerate(columns):
+                if hasattr(self.logdict[c], 'at_array'):
+                    values[i] = self.logdict[c].at(tc)
+        return values
+
+    def interp(self, times, columns=None, method='previous'):
+        """Return arrays of the values of columns at a sequence of times
+
+        With method 'previous', the values are those at or just before every
+        time, as returned by at. With method 'linear', they are interpolated
+        linearly between the logged times. Times outside the log take the
+        first or last values. Compressed columns are reconstructed by their
+        policy at the times themselves, like at does, with either method."""
+        import numpy
+        if method not in ('previous', 'linear'):
+            raise ValueError("method must be 'previous' or 'linear'.")
+        if columns is None:
+            columns = self.columns
+        t = numpy.asarray(self.t, dtype=float)
+        if not len(t):
+            raise ValueError('Nothing has been logged yet.')
+        times = numpy.asarray(times, dtype=float)
+        index = numpy.maximum(t.searchsorted(times, side='right') - 1, 0)
+        result = []
+        for c in columns:
+            column = self.logdict[c]
+            if hasattr(column, 'at_array'):
+                values = column.at_array(numpy.clip(times, t[0], t[-1]))
+            elif method == 'linear':
+                values = numpy.interp(times, t,
+                                      numpy.asarray(column, dtype=float))
+            else:
+                values = numpy.asarray(column)[index]
+            result.append(values)
+        return result
 
     def after(self, t, columns=None):
         """ Return the values of columns after or just before a certain time"""
         return self.timeslice(t, columns=columns)
 
+    def to_numpy(self, columns=None):
+        """Return the log as a 2D NumPy array with a column per field"""
+        import numpy
+        if columns is None:
+            columns = self.columns
+        return numpy.column_stack([numpy.asarray(self.logdict[c], dtype=float)
+                                   for c in columns])
+
+    def to_pandas(self, columns=None):
+        """Return the log as a pandas DataFrame indexed by Time"""
+        import pandas
+        if columns is None:
+            columns = self.columns[1:]
+        columns = ['Time'] + list(columns)
+        data = {c: self.logdict[c][:] for c in columns}
+        return pandas.DataFrame(data, columns=columns).set_index('Time')
+
     def _dbcheck(self):
         if self.db is None:
             raise NotImplementedError("Sessions not supported without dbfile")
@@ -191,44 +780,237 @@ class Historian(object):
 
     def new_session(self):
         self._dbcheck()
+        self._finish()
         self.db.new_session()
         self.session = self.db.session
-        self.tstart = labtime.time()
+        self.tstart = self.labtime.time()
         self.build_fields()
 
     def get_sessions(self):
         self._dbcheck()
         return self.db.get_sessions()
 
+    def session_summary(self, session=None):
+        """Return the number of rows, duration and tags of a session"""
+        self._dbcheck()
+        return self.db.session_summary(session)
+
+    def downsample(self, name, width, tstart=None, tend=None, session=None):
+        """Summarise a recorded signal in buckets (see TagDB.downsample)"""
+        self._dbcheck()
+        return self.db.downsample(name, width, tstart, tend, session)
+
+    def load_sessions(self, sessions, columns=None, grid=None, step=1,
+                      method='previous', stacked=False, chunksize=10000):
+        """Load several sessions resampled onto a common time grid
+
+        The times of the grid are relative to the first row of every
+        session. grid defaults to multiples of step up to the duration of
+        the longest session. method is 'previous' or 'linear' as for
+        interp, and columns default to all columns except Time.
+
+        The rows of all sessions are read together, chunksize rows at a
+        time, so only the resampled values are kept in memory. Values of
+        compressed columns which were not archived are reconstructed
+        before resampling.
+
+        Returns the grid and a dictionary with a 2D array for every session,
+        with a column for each of the columns, or with stacked, a 3D array
+        indexed by session, time and column."""
+        import numpy
+        self._dbcheck()
+        if method not in ('previous', 'linear'):
+            raise ValueError("method must be 'previous' or 'linear'.")
+        sessions = list(sessions)
+        if columns is None:
+            columns = self.columns[1:]
+        if grid is None:
+            duration = max([self.db.session_summary(s)['duration']
+                            for s in sessions] + [0])
+            grid = numpy.arange(0, duration + step / 2, step)
+        grid = numpy.asarray(grid, dtype=float)
+        resampler = _Resampler(grid, len(columns), method)
+
+        def add(session, rows):
+            if rows:
+                resampler.add(session, [row[0] for row in rows],
+                              [row[1:] for row in rows])
+
+        current = reconstructor = None
+        for rows in self.db.iter_sessions(columns, sessions, chunksize):
+            start = 0
+            for i in range(1, len(rows) + 1):
+                if i == len(rows) or rows[i][0] != rows[start][0]:
+                    session = rows[start][0]
+                    if session != current:
+                        if reconstructor is not None:
+                            add(current, reconstructor.finish())
+                        current = session
+                        reconstructor = self._reconstructor(columns)
+                    segment = [row[1:] for row in rows[start:i]]
+                    if reconstructor is not None:
+                        segment = reconstructor.add(segment)
+                    add(session, segment)
+                    start = i
+        if reconstructor is not None:
+            add(current, reconstructor.finish())
+        resampler.finish()
+        data = {session: resampler.data.get(
+                    session, numpy.full((len(grid), len(columns)), numpy.nan))
+                for session in sessions}
+        if stacked:
+            return grid, numpy.stack([data[s] for s in sessions])
+        return grid, data
+
+    def view_session(self, session, pagewidth=100, cachesize=32):
+        """Return a SessionView reading a session from the database on
+        demand, instead of loading all of it like load_session"""
+        self._dbcheck()
+        return SessionView(self.db, session, self.columns, pagewidth,
+                           cachesize, self.compression)
+
     def load_session(self, session):
+        """Load a recorded session into the columns
+
+        With arrays, the columns show the arrays returned by the storage's
+        get_arrays. For a BinaryStorage these map the session file, so the
+        session is loaded without parsing or copying it. The alarm events
+        of the session are loaded into events."""
         self._dbcheck()
+        self._finish()
         self.db.session = session
         self.build_fields()
-        # FIXME: The way time is handled here is a bit brittle
-        first = True
-        for name in self.columns[1:]:
-            for t, value in self.db.get(name):
-                self.logdict[name].append(value)
-                if first:
-                    self.t.append(t)
-            first = False
+        self.events = self.db.get_events()
+        if self.arrays and self.capacity is None and not self.compressed:
+            times, values = self.db.get_arrays(self.columns[1:])
+            for field, array in zip(self.fields, [times] + values):
+                field.set_array(array)
+            return
+        appenders = [field.append for field in self.fields]
+        for i in self.compressed:
+            appenders[i] = self.fields[i].restore
+        for row in self.db.get_session(self.columns[1:]):
+            for append, value in zip(appenders, row):
+                append(value)
 
     def close(self):
+        for subscription in self.subscriptions:
+            subscription.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
         if self.db:
+            self._finish()
             self.db.close()
 
-    def to_csv(self, filename):
-        """Output contents of log file to CSV"""
-        import csv
+    def _export(self, sessions, columns):
+        """Return the header and the list of columns to export"""
+        columns = self.columns[1:] if columns is None else list(columns)
+        header = ['Time'] + columns
+        if sessions is not None:
+            self._dbcheck()
+            header = ['Session'] + header
+        return header, columns
+
+    def _reconstructor(self, columns):
+        """Return a _Reconstructor for rows of columns, or None if none of
+        them are compressed"""
+        interpolations = [self.compression[c].interpolation
+                          if c in self.compression else None
+                          for c in columns]
+        if any(interpolations):
+            return _Reconstructor(interpolations)
+        return None
 
-        with open(filename, 'w') as f:
-            writer = csv.writer(f)
-            writer.writerow(self.columns)
-            writer.writerows(self.log)
+    def _rows(self, sessions, columns, chunksize):
+        """Yield (session, chunk of rows) read from the database, with the
+        values of compressed columns reconstructed"""
+        for session in sessions:
+            reconstructor = self._reconstructor(columns)
+            for rows in self.db.iter_session(columns, session, chunksize):
+                if reconstructor is not None:
+                    rows = reconstructor.add(rows)
+                if rows:
+                    yield session, rows
+            if reconstructor is not None:
+                rows = reconstructor.finish()
+                if rows:
+                    yield session, rows
+
+    def to_csv(self, filename, sessions=None, columns=None, chunksize=1000):
+        """Output contents of log file to CSV
+
+        The file is compressed with gzip if filename ends with .gz. With
+        a list of session ids as sessions, the rows of these sessions are
+        read from the database chunksize rows at a time instead, and the
+        session id is written in a first column, Session.
+
+        Compressed columns are reconstructed from the archived values in
+        both cases. The database only has rows at times when some value
+        was archived, so a session read back may have fewer rows than the
+        log had."""
+        from .export import write_csv
+        header, columns = self._export(sessions, columns)
+        if sessions is None:
+            rows = zip(*[self.logdict[c] for c in header])
+        else:
+            rows = ((session,) + row
+                    for session, chunk in self._rows(sessions, columns,
+                                                     chunksize)
+                    for row in chunk)
+        write_csv(filename, header, rows)
+
+    def _arrays(self, session, columns, chunksize):
+        import numpy
+        for _, rows in self._rows([session], columns, chunksize):
+            chunk = numpy.array(rows, dtype=float)
+            yield numpy.column_stack([numpy.full(len(chunk), session),
+                                      chunk])
+
+    def to_npy(self, filename, sessions=None, columns=None, chunksize=1000):
+        """Save the log as a 2D array in a NumPy .npy file
+
+        With a list of session ids as sessions, the rows of these sessions
+        are read from the database chunksize rows at a time and written
+        one after the other, with the session id in the first column."""
+        import numpy
+        from .export import write_npy
+        header, columns = self._export(sessions, columns)
+        if sessions is None:
+            numpy.save(filename, self.to_numpy(header))
+            return
+        nrows = sum(self.db.session_summary(s)['rows'] for s in sessions)
+        chunks = (chunk for session in sessions
+                  for chunk in self._arrays(session, columns, chunksize))
+        with open(filename, 'wb') as f:
+            write_npy(f, (nrows, len(header)), chunks)
+
+    def to_npz(self, filename, sessions=None, columns=None, chunksize=1000,
+               compressed=False):
+        """Save the log in a NumPy .npz file
+
+        The names of the columns are saved as the array columns, and the
+        log as the array log. With a list of session ids as sessions, each
+        session is read from the database chunksize rows at a time and
+        saved as the array session<id>, with the session id in the first
+        column. The arrays are compressed if compressed is True."""
+        import numpy
+        from .export import write_npz
+        header, columns = self._export(sessions, columns)
+        if sessions is None:
+            arrays = [('log', self.to_numpy(header))]
+        else:
+            arrays = [('session{}'.format(session),
+                       (self.db.session_summary(session)['rows'],
+                        len(header)),
+                       self._arrays(session, columns, chunksize))
+                      for session in sessions]
+        write_npz(filename, [('columns', numpy.array(header))] + arrays,
+                  compressed)
 
 
 class Plotter:
-    def __init__(self, historian, twindow=120, layout=None):
+    def __init__(self, historian, twindow=120, layout=None,
+                 minfps=3, maxskip=50):
         """Generalised graphical output of a Historian
 
         :param historian: An instance of the Historian class
@@ -239,17 +1021,23 @@ class Plotter:
                 plotted on each.
 
                 Note: A single plot is specified as (("T1",),) (note the commas)
+        :param minfps: update redraws the plot at most this many times per
+                second of real time ...
+        :param maxskip: ... unless this much labtime has passed since the
+                last redraw.
         """
         import matplotlib.pyplot as plt
         from matplotlib import get_backend
         self.backend = get_backend()
         self.historian = historian
         self.twindow = twindow
+        self.minfps = minfps
+        self.maxskip = maxskip
         self.last_plot_update = 0
         self.last_plotted_time = 0
 
         if layout is None:
-            layout = tuple((field,) for field in historian.columns[1:])
+            layout = tuple((field,) for field, _ in historian.sources[1:])
         self.layout = layout
 
         line_options = {'where': 'post', 'lw': 2, 'alpha': 0.8}
@@ -285,17 +1073,24 @@ class Plotter:
             self.display.display(self.fig)
 
     def update(self, tnow=None):
+        """Update the historian and redraw the plot at most minfps times
+        per second of real time (or every maxskip seconds of labtime)."""
         self.historian.update(tnow)
 
-        minfps = 3
-        maxskip = 50
-
         clocktime_since_refresh = time.time() - self.last_plot_update
         simtime_since_refresh = self.historian.tnow - self.last_plotted_time
 
-        if clocktime_since_refresh <= 1/minfps and simtime_since_refresh < maxskip:
+        if (clocktime_since_refresh <= 1/self.minfps
+                and simtime_since_refresh < self.maxskip):
             return
 
+        self.draw()
+
+    def draw(self):
+        """Redraw the plot from the historian.
+
+        Use this instead of update when the historian is updated elsewhere,
+        for instance when plotting is a separate task of a Scheduler."""
         tmin = max(self.historian.tnow - self.twindow, 0)
         tmax = max(self.historian.tnow, self.twindow)
         for axis in self.axes:
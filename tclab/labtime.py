@@ -1,12 +1,24 @@
+from array import array
+import math
 import time as time
 
+# Monotonic, high resolution real time used as the base of labtime
+realtime = getattr(time, 'perf_counter', time.time)
+
 
 class Labtime():
-    def __init__(self):
-        self._realtime = time.time()
+    """A clock which can run faster than real time, be stopped and reset.
+
+    The module-level `labtime` instance is shared by default, but labs,
+    historians and experiments can each be given their own instance so that
+    several of them can run independently in one process.
+    """
+    def __init__(self, virtual=False):
+        self._realtime = realtime()
         self._labtime = 0
         self._rate = 1
         self._running = True
+        self._virtual = virtual
         self.lastsleep = 0
 
     @property
@@ -14,10 +26,24 @@ class Labtime():
         """Returns variable indicating whether labtime is running."""
         return self._running
 
+    @property
+    def virtual(self):
+        """Returns variable indicating whether labtime is virtual.
+
+        Virtual labtime is decoupled from real time. It only advances when
+        `sleep` is called, and sleeping returns immediately."""
+        return self._virtual
+
+    def set_virtual(self, virtual=True):
+        """Switch between virtual and real time, keeping current labtime."""
+        self._labtime = self.time()
+        self._realtime = realtime()
+        self._virtual = virtual
+
     def time(self):
         """Return current labtime."""
-        if self.running:
-            elapsed = time.time() - self._realtime
+        if self.running and not self.virtual:
+            elapsed = realtime() - self._realtime
             return self._labtime + self._rate * elapsed
         else:
             return self._labtime
@@ -27,7 +53,7 @@ class Labtime():
         if rate <= 0:
             raise ValueError("Labtime rates must be positive.")
         self._labtime = self.time()
-        self._realtime = time.time()
+        self._realtime = realtime()
         self._rate = rate
 
     def get_rate(self):
@@ -38,73 +64,236 @@ class Labtime():
         """Sleep in labtime for a period delay."""
         self.lastsleep = delay
         if self._running:
-            time.sleep(delay / self._rate)
+            if self._virtual:
+                self._labtime += max(delay, 0)
+            else:
+                time.sleep(delay / self._rate)
         else:
             raise RuntimeWarning("sleep is not valid when labtime is stopped.")
 
     def stop(self):
         """Stop labtime."""
         self._labtime = self.time()
-        self._realtime = time.time()
+        self._realtime = realtime()
         self._running = False
 
     def start(self):
         """Restart labtime."""
-        self._realtime = time.time()
+        self._realtime = realtime()
         self._running = True
 
     def reset(self, val=0):
         """Reset labtime to a specified value."""
         self._labtime = val
-        self._realtime = time.time()
-
-
-labtime = Labtime()
+        self._realtime = realtime()
 
+    def clock(self, period, step=1, tol=float('inf'), adaptive=True, spin=0,
+              slack=0.5):
+        """Return a Clock providing labtime values in sync with real time.
 
-# for backwards compatability
-def setnow(tnow=0):
-    labtime.reset(tnow)
+        See `Clock` for a description of the arguments."""
+        return Clock(self, period, step, tol, adaptive, spin, slack)
 
 
-def clock(period, step=1, tol=float('inf'), adaptive=True):
-    """Generator providing time values in sync with real time clock.
+class Clock(object):
+    """Iterator providing labtime values in sync with real time clock.
 
     Args:
+        labtime (Labtime): The labtime to run the clock on.
         period (float): Time interval for clock operation in seconds.
         step (float): Time step.
         tol (float): Maximum permissible deviation from real time.
-        adaptive (Boolean): If true, and if the rate != 1, then the labtime
-            rate is adjusted to maximize simulation speed.
+        adaptive (Boolean): If true, and if the rate != 1 when the clock
+            starts, then the labtime rate is adjusted to maximize simulation
+            speed. Ignored when labtime is virtual.
+        spin (float): Real time in seconds to busy-wait before each tick
+            instead of sleeping. A few milliseconds removes most of the
+            jitter caused by the operating system waking up late, at the
+            cost of keeping a CPU busy.
+        slack (float): The fraction of each step which the adaptive rate
+            controller tries to keep free of work.
 
     Yields:
         float: The next time step rounded to nearest 10th of a second.
 
+    Every tick is scheduled at an absolute deadline, a whole number of steps
+    after the start, so lateness does not accumulate. How late each tick
+    was is recorded and summarised by `statistics`.
+
+    The adaptive rate controller keeps a running estimate of the real time
+    needed for the work done in each step, and sets the labtime rate so that
+    this work takes up a fraction (1 - slack) of the step. The rate is raised
+    by at most a factor of two per step, but lowered straight away when a
+    step takes longer than expected. The speedup actually achieved is
+    available as `speedup`.
 
     Note:
-        * Passing `tol=float('inf')` will effectively disable sync error checking
-        * When large values for `tol` are used, no guarantees are made that the
-          last time returned will be equal to `period`.
+        * Passing `tol=float('inf')` will effectively disable sync error
+          checking
+        * When large values for `tol` are used, no guarantees are made
+          that the last time returned will be equal to `period`.
+        * With virtual labtime, each step jumps straight to the next tick,
+          so the loop runs as fast as the body allows and is never out of
+          sync.
     """
-    start = labtime.time()
-    now = 0
-
-    while round(now, 0) <= period:
-        yield round(now, 2)
-        if round(now) >= period:
-            break
-        elapsed = labtime.time() - (start + now)
+    def __init__(self, labtime, period, step=1, tol=float('inf'),
+                 adaptive=True, spin=0, slack=0.5):
+        if not 0 <= slack < 1:
+            raise ValueError('slack must be at least 0 and less than 1.')
+        self.labtime = labtime
+        self.period = period
+        self.step = step
+        self.tol = tol
+        self.adaptive = adaptive
+        self.spin = spin
+        self.slack = slack
+        self.lateness = array('d')
+        self.overruns = 0
+        self.cost = None
+        self._start = None
+        self._realstart = None
+        self._arrived = None
+        self._now = 0
+        self._tick = 0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._started():
+            self._wait()
+        return self._current()
+
+    next = __next__
+
+    def _started(self):
+        """Start the clock on the first call, return True if it was running.
+
+        Raises StopIteration when the clock has finished."""
+        if self._done:
+            raise StopIteration
+        if self._start is None:
+            self._start = self.labtime.time()
+            self._realstart = self._arrived = realtime()
+            self.adaptive = self.adaptive and self.labtime.get_rate() != 1
+            return False
+        if round(self._now) >= self.period:
+            self._done = True
+            raise StopIteration
+        return True
+
+    def _current(self):
+        """Return the current clock value after a tick."""
+        if round(self._now, 0) > self.period:
+            self._done = True
+            raise StopIteration
+        return round(self._now, 2)
+
+    def _check(self):
+        """Check synchronisation or adapt the labtime rate after a step."""
+        labtime = self.labtime
+        step = self.step
+        elapsed = labtime.time() - (self._start + self._now)
         rate = labtime.get_rate()
-        if (rate != 1) and adaptive:
-            if elapsed > step:
-                labtime.set_rate(0.8 * rate * step / elapsed)
-            elif (elapsed < 0.5 * step) & (rate < 50):
-                labtime.set_rate(1.25 * rate)
+        if labtime.virtual:
+            pass
+        elif self.adaptive:
+            self._adapt(rate)
         else:
-            if elapsed > step + tol:
-                message = ('Labtime clock lost synchronization with real time. '
-                           'Step size was {} s, but {:.2f} s elapsed '
+            if elapsed > step + self.tol:
+                message = ('Labtime clock lost synchronization with real '
+                           'time. Step size was {} s, but {:.2f} s elapsed '
                            '({:.2f} too long). Consider increasing step.')
-                raise RuntimeError(message.format(step, elapsed, elapsed-step))
-        labtime.sleep(step - (labtime.time() - start) % step)
-        now = labtime.time() - start
+                raise RuntimeError(message.format(step, elapsed,
+                                                  elapsed-step))
+
+    def _adapt(self, rate):
+        """Set the labtime rate from the real time taken by the last step."""
+        cost = max(realtime() - self._arrived, 1e-9)
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost += 0.2 * (cost - self.cost)
+        target = (1 - self.slack) * self.step / max(cost, self.cost)
+        self.labtime.set_rate(min(target, 2 * rate))
+
+    def _deadline(self):
+        """Return the next tick, relative to the start of the clock."""
+        ticks = math.floor((self.labtime.time() - self._start) / self.step
+                           + 1e-9) + 1
+        if ticks > self._tick + 1:
+            self.overruns += 1
+        self._tick = ticks
+        return ticks * self.step
+
+    def _delay(self, deadline):
+        """Return the labtime left until deadline."""
+        return max(deadline - (self.labtime.time() - self._start), 0)
+
+    def _arrive(self, deadline):
+        """Record the time of arrival at the tick for deadline."""
+        self._now = self.labtime.time() - self._start
+        self._arrived = realtime()
+        self.lateness.append(self._now - deadline)
+
+    @property
+    def speedup(self):
+        """The ratio of labtime to real time elapsed since the clock start."""
+        if self._start is None:
+            return None
+        real = realtime() - self._realstart
+        if real <= 0:
+            return float('inf')
+        return (self.labtime.time() - self._start) / real
+
+    def _wait(self):
+        self._check()
+        labtime = self.labtime
+        deadline = self._deadline()
+        spin = 0 if labtime.virtual else self.spin * labtime.get_rate()
+        labtime.sleep(self._delay(deadline - spin))
+        if spin:
+            while labtime.time() - self._start < deadline:
+                pass
+        self._arrive(deadline)
+
+    def statistics(self):
+        """Return a dictionary summarising the lateness of the ticks so far.
+
+        The values are in seconds of labtime: ticks is the number of ticks
+        waited for, mean, p99 and max describe how late they were and
+        overruns counts the steps that took so long that at least one tick
+        was skipped. speedup is the ratio of labtime to real time."""
+        lateness = sorted(self.lateness)
+        n = len(lateness)
+        if n:
+            mean = sum(lateness) / n
+            p99 = lateness[min(int(math.ceil(0.99 * n)), n) - 1]
+            worst = lateness[-1]
+        else:
+            mean = p99 = worst = 0
+        return {'ticks': n,
+                'mean': mean,
+                'p99': p99,
+                'max': worst,
+                'overruns': self.overruns,
+                'speedup': self.speedup}
+
+
+labtime = Labtime()
+
+
+# for backwards compatability
+def setnow(tnow=0):
+    labtime.reset(tnow)
+
+
+def clock(period, step=1, tol=float('inf'), adaptive=True, spin=0,
+          slack=0.5):
+    """Generator providing time values in sync with real time clock.
+
+    This runs a `Clock` on the module-level labtime. See there for a
+    description of the arguments.
+    """
+    return labtime.clock(period, step, tol, adaptive, spin, slack)
@@ -0,0 +1,112 @@
+from __future__ import division
+import math
+
+from .labtime import labtime as default_labtime
+
+
+class Task(object):
+    """A callback run periodically by a Scheduler"""
+    def __init__(self, callback, period, phase=0, priority=0, name=None):
+        if period <= 0:
+            raise ValueError('Task periods must be positive.')
+        self.callback = callback
+        self.period = period
+        self.phase = phase
+        self.priority = priority
+        self.name = name if name is not None else getattr(callback, '__name__',
+                                                          repr(callback))
+        self.runs = 0
+        self.shed = 0
+        self.missed = 0
+        self.reset()
+
+    def reset(self):
+        self._tick = 0
+        self.next = self.phase
+
+    def reschedule(self):
+        """Move on to the next tick"""
+        self._tick += 1
+        self.next = self.phase + self._tick * self.period
+
+    def skip(self, now):
+        """Skip all overdue ticks at time now except the latest one"""
+        if self.next + self.period <= now:
+            ticks = math.floor((now - self.phase) / self.period + 1e-9)
+            self.missed += ticks - self._tick
+            self._tick = ticks
+            self.next = self.phase + self._tick * self.period
+
+    def __repr__(self):
+        return 'Task({!r}, period={}, phase={}, priority={})'.format(
+            self.name, self.period, self.phase, self.priority)
+
+
+class Scheduler(object):
+    """Run callbacks at different rates on one labtime base
+
+    >>> scheduler = Scheduler()
+    >>> scheduler.add(historian.update, 0.1, priority=2)
+    >>> scheduler.add(controller, 1, priority=1)
+    >>> scheduler.add(lambda t: plotter.draw(), 1/3, priority=0)
+    >>> scheduler.run(600)  # doctest: +SKIP
+
+    Each callback is called with the scheduled time of its tick, measured
+    from the start of `run`. When several tasks are due at the same time they
+    run in order of decreasing priority. If a tick runs so long that the next
+    scheduled event is already due, the remaining tasks of lower priority
+    than the first one are shed: they are skipped for this tick and counted
+    in `Task.shed`. Tasks that fall more than a period behind skip to their
+    latest tick rather than trying to catch up, which is counted in
+    `Task.missed`.
+    """
+    def __init__(self, labtime=None):
+        self.labtime = default_labtime if labtime is None else labtime
+        self.tasks = []
+        self.overruns = 0
+
+    def add(self, callback, period, phase=0, priority=0, name=None):
+        """Register callback to be called every period seconds of labtime,
+        starting at phase. Returns the Task."""
+        task = Task(callback, period, phase, priority, name)
+        self.tasks.append(task)
+        return task
+
+    def remove(self, task):
+        self.tasks.remove(task)
+
+    def run(self, duration):
+        """Run the registered tasks until duration seconds of labtime."""
+        labtime = self.labtime
+        for task in self.tasks:
+            task.reset()
+        start = labtime.time()
+        while self.tasks:
+            tnext = min(task.next for task in self.tasks)
+            if tnext > duration + 1e-9:
+                break
+            labtime.sleep(max(tnext - (labtime.time() - start), 0))
+
+            due = sorted((task for task in self.tasks
+                          if task.next <= tnext + 1e-9),
+                         key=lambda task: -task.priority)
+            for task in due:
+                task.reschedule()
+            tfollow = min(task.next for task in self.tasks)
+
+            overrun = False
+            for task in due:
+                if task.priority < due[0].priority:
+                    overrun = overrun or labtime.time() - start >= tfollow
+                    if overrun:
+                        task.shed += 1
+                        continue
+                task.callback(tnext)
+                task.runs += 1
+
+            now = labtime.time() - start
+            if now >= tfollow:
+                self.overruns += 1
+                if tfollow <= duration:
+                    for task in self.tasks:
+                        task.skip(now)
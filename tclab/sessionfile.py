@@ -0,0 +1,114 @@
+"""Append-only binary files holding the rows of one session
+
+A session file starts with a fixed header:
+
+    8 bytes   magic b'TCLABSES'
+    4 bytes   format version, little-endian unsigned int
+    4 bytes   total size of the header in bytes, little-endian unsigned int
+    JSON      {"columns": [...], "starttime": "..."}, padded with spaces
+              so that the header size is a multiple of 8
+
+followed by the rows, each made of one little-endian float64 per column.
+The first column is Time. Missing values are stored as NaN. Rows are only
+ever appended, and the number of rows follows from the size of the file,
+so the header never changes and the rows can be memory-mapped while more
+are being written. An incomplete row at the end, left by a writer which is
+still writing or was interrupted, is ignored.
+"""
+from __future__ import division
+
+import json
+import os
+import struct
+
+magic = b'TCLABSES'
+version = 1
+prefix = struct.Struct('<8sII')
+
+
+class SessionFile(object):
+    """A session file, open for reading or appending rows
+
+    `SessionFile(filename)` opens an existing file for reading and
+    `SessionFile.create` creates a new one for appending. Rows appended are
+    buffered until `flush`.
+    """
+    def __init__(self, filename, mode='r'):
+        self.filename = filename
+        self.mode = mode
+        with open(filename, 'rb') as f:
+            start = f.read(prefix.size)
+            if len(start) < prefix.size:
+                raise ValueError('{} is not a session file'.format(filename))
+            code, fileversion, self.headersize = prefix.unpack(start)
+            if code != magic:
+                raise ValueError('{} is not a session file'.format(filename))
+            if fileversion > version:
+                raise ValueError('{} has an unsupported version {}'.format(
+                    filename, fileversion))
+            header = json.loads(
+                f.read(self.headersize - prefix.size).decode('utf-8'))
+        self.columns = header['columns']
+        self.starttime = header.get('starttime')
+        self.rowformat = struct.Struct('<{}d'.format(len(self.columns)))
+        self.file = open(filename, 'ab') if mode == 'a' else None
+        self._map = None
+        self._maprows = 0
+
+    @classmethod
+    def create(cls, filename, columns, starttime=None):
+        """Create a session file with the given columns, open for appending"""
+        columns = list(columns)
+        header = json.dumps({'columns': columns,
+                             'starttime': starttime}).encode('utf-8')
+        size = prefix.size + len(header)
+        size += -size % 8
+        if os.path.exists(filename):
+            raise ValueError('{} already exists'.format(filename))
+        with open(filename, 'wb') as f:
+            f.write(prefix.pack(magic, version, size))
+            f.write(header.ljust(size - prefix.size))
+        return cls(filename, 'a')
+
+    def append(self, row):
+        """Append a row of values, one per column. None is stored as NaN"""
+        self.file.write(self.rowformat.pack(
+            *[float('nan') if v is None else v for v in row]))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        """Write the appended rows, so that readers see them"""
+        if self.file is not None:
+            self.file.flush()
+
+    @property
+    def nrows(self):
+        """The number of complete rows written to the file"""
+        size = os.path.getsize(self.filename) - self.headersize
+        return size // self.rowformat.size
+
+    def array(self):
+        """Return the rows as a 2D NumPy array mapped from the file
+
+        The array is a read-only view of the file, not a copy. Call again to
+        see rows written since."""
+        import numpy
+        nrows = self.nrows
+        if self._map is None or nrows != self._maprows:
+            if nrows:
+                self._map = numpy.memmap(self.filename, dtype='<f8',
+                                         mode='r', offset=self.headersize,
+                                         shape=(nrows, len(self.columns)))
+            else:
+                self._map = numpy.empty((0, len(self.columns)))
+            self._maprows = nrows
+        return self._map
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self._map = None
@@ -0,0 +1,498 @@
+"""Storage backends for the Historian
+
+A storage backend keeps sessions of rows of values of named tags. The
+SQLite `TagDB` is the default backend. `MemoryStorage` keeps the sessions in
+Python lists, one per tag, without any SQL overhead but also without
+persistence. `BinaryStorage` writes every session to an append-only
+`SessionFile` in a directory and reads them back by memory-mapping the
+files.
+
+New backends derive from `Storage` and implement new_session, record_row,
+record_event, get_sessions, session_summary, get_session, get_chunk,
+get_events and delete_session.
+The other methods used by the Historian are built on those.
+"""
+from __future__ import division
+
+import bisect
+import json
+import math
+import os
+import re
+import time
+
+
+def _chunks(get_chunk, args, chunksize):
+    """Yield the chunks returned by get_chunk(*args, after, chunksize)"""
+    after = None
+    while True:
+        rows, after = get_chunk(*(args + (after, chunksize)))
+        if not rows:
+            return
+        yield rows
+
+
+def _now():
+    """The current time in the format used by SQLite datetime('now')"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+def _summary(session, starttime, times, tags):
+    nrows = len(times)
+    tfirst = min(times) if nrows else None
+    tlast = max(times) if nrows else None
+    return {'id': session,
+            'starttime': starttime,
+            'rows': nrows,
+            'tfirst': tfirst,
+            'tlast': tlast,
+            'duration': tlast - tfirst if nrows else 0,
+            'tags': list(tags)}
+
+
+class Storage(object):
+    """Interface of the storage backends of the Historian
+
+    Rows are recorded in the current session, `session`, which is started
+    with `new_session`. Rows read back are tuples of the time and the values
+    of the requested tags, ordered by time, with None for missing values.
+    """
+    session = None
+
+    def new_session(self):
+        raise NotImplementedError
+
+    def record_row(self, timeseconds, names, values):
+        """Record the values of several tags at one time."""
+        raise NotImplementedError
+
+    def record(self, timeseconds, name, value):
+        """Record a single value."""
+        self.record_row(timeseconds, [name], [value])
+
+    def record_event(self, timeseconds, name, active, value=None):
+        """Record that an alarm was raised or cleared."""
+        raise NotImplementedError
+
+    def get_events(self, session=None):
+        """Return a list of (timeseconds, name, active, value) of the
+        events of a session, ordered by time"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Write out buffered rows"""
+
+    def get_sessions(self):
+        """Return a list of (id, starttime, number of rows) of all sessions"""
+        raise NotImplementedError
+
+    def session_summary(self, session=None):
+        """Return a dictionary summarising a session"""
+        raise NotImplementedError
+
+    def get_session(self, names, session=None, tstart=None, tend=None):
+        """Return a list of (timeseconds, value, ...) rows with the values
+        of the named tags in a session, ordered by time.
+
+        If tstart or tend is given, only rows at times tstart <= t < tend
+        are returned."""
+        raise NotImplementedError
+
+    def get_arrays(self, names, session=None):
+        """Return the times and a list of the values of the named tags in a
+        session as NumPy arrays, ordered by time. Missing values are nan."""
+        import numpy
+        rows = self.get_session(names, session)
+        data = numpy.array(rows, dtype=float).reshape(len(rows),
+                                                       len(names) + 1)
+        return data[:, 0], [data[:, i] for i in range(1, len(names) + 1)]
+
+    def get_chunk(self, names, session=None, after=None, size=1000):
+        """Return up to size rows of a session like get_session, starting
+        after a position.
+
+        Returns the rows and the position of the last row, which is passed
+        as after to get the next chunk. after is None for the first chunk."""
+        raise NotImplementedError
+
+    def delete_session(self, session_id):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def get(self, name, timeseconds=None, session=None):
+        """Return the (timeseconds, value) pairs recorded for a tag"""
+        return [row for row in self.get_session([name], session)
+                if row[1] is not None
+                and (timeseconds is None or row[0] == timeseconds)]
+
+    def iter_session(self, names, session=None, chunksize=1000):
+        """Iterate over the rows of a session in lists of chunksize rows"""
+        return _chunks(self.get_chunk, (names, session), chunksize)
+
+    def get_sessions_chunk(self, names, sessions, after=None, size=1000):
+        """Return up to size rows of several sessions, starting after a
+        position, like get_chunk.
+
+        The rows are (session id, timeseconds, value, ...), ordered by
+        session and time."""
+        sessions = list(sessions)
+        index, position = (0, None) if after is None else after
+        while index < len(sessions):
+            session = sessions[index]
+            rows, last = self.get_chunk(names, session, position, size)
+            if rows:
+                return ([(session,) + row for row in rows],
+                        (index, last))
+            index, position = index + 1, None
+        return [], after
+
+    def iter_sessions(self, names, sessions, chunksize=1000):
+        """Iterate over the rows of several sessions in lists of chunksize
+        rows"""
+        return _chunks(self.get_sessions_chunk, (names, sessions), chunksize)
+
+    def last_time(self, t, session=None):
+        """Return the last time at or before t in a session, or None"""
+        times = [row[0] for row in self.get_session([], session)
+                 if row[0] <= t]
+        return max(times) if times else None
+
+    def downsample(self, name, width, tstart=None, tend=None, session=None):
+        """Summarise the values of a tag in buckets of width seconds.
+
+        Returns a list of (bucket start time, min, max, mean, first, last,
+        number of values) as `TagDB.downsample`."""
+        buckets = {}
+        for t, value in self.get_session([name], session, tstart, tend):
+            if value is None:
+                continue
+            key = math.floor(t / width)
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [value, value, value, value, value, 1]
+            else:
+                b[0] = min(b[0], value)
+                b[1] = max(b[1], value)
+                b[2] += value
+                b[4] = value
+                b[5] += 1
+        return [(key * width, b[0], b[1], b[2] / b[5], b[3], b[4], b[5])
+                for key, b in sorted(buckets.items())]
+
+
+class _MemorySession(object):
+    """The rows of a session in memory, with a list per tag"""
+    def __init__(self, starttime):
+        self.starttime = starttime
+        self.times = []
+        self.columns = {}
+        self.events = []
+        self.ordered = True
+
+    def append(self, timeseconds, names, values):
+        times, columns = self.times, self.columns
+        if times and timeseconds < times[-1]:
+            self.ordered = False
+        n = len(times)
+        for name, value in zip(names, values):
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * n
+            column.append(value)
+        times.append(timeseconds)
+        if len(names) < len(columns):
+            for column in columns.values():
+                if len(column) == n:
+                    column.append(None)
+
+    def order(self):
+        """Sort the rows by time, keeping rows at the same time in order"""
+        if not self.ordered:
+            index = sorted(range(len(self.times)), key=self.times.__getitem__)
+            self.times = [self.times[i] for i in index]
+            for name, column in self.columns.items():
+                self.columns[name] = [column[i] for i in index]
+            self.ordered = True
+
+    def rows(self, names, start, stop):
+        none = [None] * len(self.times)
+        columns = [self.columns.get(name, none)[start:stop]
+                   for name in names]
+        return list(zip(self.times[start:stop], *columns))
+
+
+class MemoryStorage(Storage):
+    """Storage keeping sessions in memory in a list per tag
+
+    Nothing is kept once the storage is closed or the process ends."""
+    def __init__(self):
+        self.sessions = {}
+        self.session = None
+
+    def _get(self, session):
+        if session is None:
+            session = self.session
+        try:
+            return self.sessions[session]
+        except KeyError:
+            raise KeyError('No session {}'.format(session))
+
+    def new_session(self):
+        self.session = max(list(self.sessions) + [0]) + 1
+        self.sessions[self.session] = _MemorySession(_now())
+
+    def record_row(self, timeseconds, names, values):
+        if self.session is None:
+            self.new_session()
+        self.sessions[self.session].append(timeseconds, names, values)
+
+    def record_event(self, timeseconds, name, active, value=None):
+        if self.session is None:
+            self.new_session()
+        self.sessions[self.session].events.append(
+            (timeseconds, name, bool(active), value))
+
+    def get_events(self, session=None):
+        return sorted(self._get(session).events, key=lambda e: e[0])
+
+    def get_sessions(self):
+        return [(id, s.starttime, len(s.times))
+                for id, s in sorted(self.sessions.items())]
+
+    def session_summary(self, session=None):
+        s = self._get(session)
+        return _summary(self.session if session is None else session,
+                        s.starttime, s.times, s.columns)
+
+    def get_session(self, names, session=None, tstart=None, tend=None):
+        s = self._get(session)
+        s.order()
+        start = 0 if tstart is None else bisect.bisect_left(s.times, tstart)
+        stop = None if tend is None else bisect.bisect_left(s.times, tend)
+        return s.rows(names, start, stop)
+
+    def get_chunk(self, names, session=None, after=None, size=1000):
+        s = self._get(session)
+        s.order()
+        start = after or 0
+        rows = s.rows(names, start, start + size)
+        return rows, start + len(rows)
+
+    def delete_session(self, session_id):
+        self.sessions.pop(session_id, None)
+
+
+class BinaryStorage(Storage):
+    """Storage writing every session to a SessionFile in a directory
+
+    Sessions are stored as session<id>.tcs, and their alarm events as
+    session<id>.events. The columns of a session are fixed by the first
+    row recorded in it. Reads flush the rows written so
+    far and memory-map the files, so they need NumPy."""
+    pattern = re.compile(r'session(\d+)\.tcs$')
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.files = {}
+        self.writer = None
+        self.writersession = None
+        self.starttime = None
+        self.session = None
+
+    def _filename(self, session, extension='tcs'):
+        return os.path.join(self.directory,
+                            'session{}.{}'.format(session, extension))
+
+    def _ids(self):
+        ids = set(int(m.group(1)) for m in map(self.pattern.match,
+                                               os.listdir(self.directory))
+                  if m)
+        if self.session is not None:
+            ids.add(self.session)
+        return sorted(ids)
+
+    def _file(self, session):
+        """Return the SessionFile of a session, or None if it has no rows"""
+        if session is None:
+            session = self.session
+        if session == self.writersession and self.writer is not None:
+            self.writer.flush()
+            return self.writer
+        sessionfile = self.files.get(session)
+        if sessionfile is None:
+            filename = self._filename(session)
+            if not os.path.exists(filename):
+                if session == self.session:
+                    return None
+                raise KeyError('No session {}'.format(session))
+            from .sessionfile import SessionFile
+            sessionfile = self.files[session] = SessionFile(filename)
+        return sessionfile
+
+    def _closewriter(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.writersession = None
+
+    def new_session(self):
+        self._closewriter()
+        self.session = max(self._ids() + [0]) + 1
+        self.starttime = _now()
+
+    def record_row(self, timeseconds, names, values):
+        from .sessionfile import SessionFile
+        if self.session is None:
+            self.new_session()
+        names = tuple(names)
+        if self.writer is None or self.writersession != self.session:
+            self._closewriter()
+            filename = self._filename(self.session)
+            if os.path.exists(filename):
+                self.files.pop(self.session, None)
+                self.writer = SessionFile(filename, 'a')
+            else:
+                self.writer = SessionFile.create(filename, ('Time',) + names,
+                                                 self.starttime)
+            self.writersession = self.session
+            self.names = tuple(self.writer.columns[1:])
+        if names != self.names:
+            row = dict(zip(names, values))
+            unknown = set(row) - set(self.names)
+            if unknown:
+                raise ValueError('Cannot add tags {} to a session file'.format(
+                    sorted(unknown)))
+            values = [row.get(name) for name in self.names]
+        self.writer.append((timeseconds,) + tuple(values))
+
+    def record_event(self, timeseconds, name, active, value=None):
+        """Record an event as a line of JSON in session<id>.events"""
+        if self.session is None:
+            self.new_session()
+        event = json.dumps([timeseconds, name, bool(active), value])
+        with open(self._filename(self.session, 'events'), 'a') as f:
+            f.write(event + '\n')
+
+    def get_events(self, session=None):
+        if session is None:
+            session = self.session
+        filename = self._filename(session, 'events')
+        if not os.path.exists(filename):
+            if session not in self._ids():
+                raise KeyError('No session {}'.format(session))
+            return []
+        with open(filename) as f:
+            events = [tuple(json.loads(line)) for line in f]
+        return sorted(events, key=lambda e: e[0])
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def get_sessions(self):
+        result = []
+        for session in self._ids():
+            sessionfile = self._file(session)
+            if sessionfile is None:
+                result.append((session, self.starttime, 0))
+            else:
+                result.append((session, sessionfile.starttime,
+                               sessionfile.nrows))
+        return result
+
+    def session_summary(self, session=None):
+        if session is None:
+            session = self.session
+        sessionfile = self._file(session)
+        if sessionfile is None:
+            return _summary(session, self.starttime, [], [])
+        times = sessionfile.array()[:, 0]
+        summary = _summary(session, sessionfile.starttime, [],
+                           sessionfile.columns[1:])
+        if len(times):
+            summary.update(rows=len(times),
+                           tfirst=float(times.min()),
+                           tlast=float(times.max()),
+                           duration=float(times.max() - times.min()))
+        return summary
+
+    def _array(self, names, session):
+        """Return the times and columns of names of a session, by time"""
+        import numpy
+        sessionfile = self._file(session)
+        if sessionfile is None:
+            return numpy.empty(0), [None] * len(names)
+        data = sessionfile.array()
+        times = data[:, 0]
+        if len(times) and (numpy.diff(times) < 0).any():
+            index = numpy.argsort(times, kind='stable')
+            data = data[index]
+            times = data[:, 0]
+        columns = sessionfile.columns
+        return times, [data[:, columns.index(name)] if name in columns
+                       else None for name in names]
+
+    def get_arrays(self, names, session=None):
+        """Return the times and values like `Storage.get_arrays`.
+
+        The arrays are views of the memory-mapped file, not copies, unless
+        the rows were not recorded in order of time."""
+        import numpy
+        times, columns = self._array(names, session)
+        return times, [numpy.full(len(times), numpy.nan) if c is None else c
+                       for c in columns]
+
+    @staticmethod
+    def _rows(times, columns, start, stop):
+        n = len(times[start:stop])
+        values = []
+        for c in columns:
+            if c is None:
+                values.append([None] * n)
+                continue
+            c = c[start:stop]
+            if (c != c).any():
+                values.append([None if v != v else v for v in c.tolist()])
+            else:
+                values.append(c.tolist())
+        return list(zip(times[start:stop].tolist(), *values))
+
+    def get_session(self, names, session=None, tstart=None, tend=None):
+        times, columns = self._array(names, session)
+        start = 0 if tstart is None else int(times.searchsorted(tstart))
+        stop = len(times) if tend is None else int(times.searchsorted(tend))
+        return self._rows(times, columns, start, stop)
+
+    def get_chunk(self, names, session=None, after=None, size=1000):
+        times, columns = self._array(names, session)
+        start = after or 0
+        rows = self._rows(times, columns, start, start + size)
+        return rows, start + len(rows)
+
+    def last_time(self, t, session=None):
+        times, _ = self._array([], session)
+        i = int(times.searchsorted(t, side='right'))
+        return float(times[i - 1]) if i else None
+
+    def delete_session(self, session_id):
+        sessionfile = self.files.pop(session_id, None)
+        if sessionfile is not None:
+            sessionfile.close()
+        if session_id == self.writersession:
+            self._closewriter()
+        for extension in ['tcs', 'events']:
+            filename = self._filename(session_id, extension)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def close(self):
+        self.flush()
+        for sessionfile in list(self.files.values()) + [self.writer]:
+            if sessionfile is not None:
+                sessionfile.close()
+        self.files = {}
+        self.writer = None
@@ -0,0 +1,925 @@
+"""SQLite storage for the Historian
+
+`TagDB` keeps sessions of tag values in an SQLite database and is the
+default storage of the Historian. `BackgroundWriter` runs a TagDB on a
+thread of its own, so that recording never waits for the disk.
+"""
+from __future__ import division
+from collections import deque
+import json
+import math
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+
+from .labtime import realtime
+from .storage import Storage, _chunks
+
+
+class TagDB(Storage):
+    """Interface to sqlite database containing tag values
+
+    Values are stored with one row per time in the samples table, with a
+    column for every tag. The tags table maps tag names to the integer ids
+    used to name the columns, so a tag called "T1" is stored in the column
+    tag<id>. Tags which were not recorded at a certain time are NULL.
+
+    Recorded values are buffered and written in a single transaction once
+    `buffersize` rows have been collected or `flushinterval` seconds have
+    passed since the last write. Reading from the database, `flush` and
+    `close` write out any buffered rows first.
+
+    The sessions table keeps a summary of every session: the number of
+    rows, the first and last time and the names of the tags recorded. It is
+    updated whenever rows are written, so listing sessions does not need to
+    scan the samples.
+
+    `downsample` summarises the values of a tag in time buckets within
+    SQLite. For bucket widths given as `rollups`, the summaries are also
+    kept up to date in the rollups table whenever rows are written, so that
+    downsampling with these widths only reads one row per bucket.
+
+    With `readers`, queries run on a pool of read-only connections, so that
+    other threads can read while rows are being recorded. Every query first
+    writes the buffered rows, so that it sees everything recorded so far.
+
+    Databases written by older versions, which stored one row per value in
+    a tagvalues table, are migrated to this layout when they are opened.
+    """
+    journal_modes = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+    synchronous_levels = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+    # Index of the bucket of width :width which contains timeseconds
+    bucket = """(CAST(timeseconds * 1.0 / :width AS INTEGER)
+                 - (timeseconds < 0 AND CAST(timeseconds * 1.0 / :width
+                                             AS INTEGER)
+                                        != timeseconds * 1.0 / :width))"""
+
+    def __init__(self, filename=":memory:", buffersize=100, flushinterval=1,
+                 journal_mode='WAL', synchronous='NORMAL', rollups=(),
+                 readers=0):
+        """Create or connect to a database
+
+        :param filename: The filename of the database.
+                         By default, values are stored in memory.
+        :param buffersize: Number of rows to collect before writing them.
+                           Use 1 to write every row as it is recorded.
+        :param flushinterval: Maximum time in seconds which recorded rows
+                              are held before being written.
+        :param journal_mode: SQLite journal mode. The default write-ahead
+                             log needs the fewest disk syncs per transaction.
+        :param synchronous: SQLite synchronous level, one of OFF, NORMAL,
+                            FULL or EXTRA. NORMAL is safe with WAL, but a
+                            power failure may lose the last transactions.
+        :param rollups: Bucket widths in seconds for which to maintain
+                        summaries. Summaries for existing data are
+                        calculated when a width is first added. Widths
+                        added earlier are always maintained.
+        :param readers: Maximum number of read-only connections for queries.
+                        With readers, the TagDB can be used from several
+                        threads. This needs a file and the WAL journal
+                        mode."""
+        if journal_mode.upper() not in self.journal_modes:
+            raise ValueError('journal_mode must be one of '
+                             + ', '.join(self.journal_modes))
+        if synchronous.upper() not in self.synchronous_levels:
+            raise ValueError('synchronous must be one of '
+                             + ', '.join(self.synchronous_levels))
+        self.buffersize = buffersize
+        self.flushinterval = flushinterval
+        self.buffer = []
+        self.eventbuffer = []
+        self.pending = None
+        if readers and (filename == ':memory:'
+                        or journal_mode.upper() != 'WAL'):
+            raise ValueError('Readers need a database file in WAL mode.')
+        self.lastflush = realtime()
+        self.filename = filename
+        self.readers = readers
+        self.pool = []
+        self.available = threading.BoundedSemaphore(max(readers, 1))
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(filename, check_same_thread=not readers)
+        self.cursor = self.db.cursor()
+        self.cursor.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        self.cursor.execute('PRAGMA synchronous={}'.format(synchronous))
+        creates = ["""CREATE TABLE IF NOT EXISTS sessions (
+                           id INTEGER PRIMARY KEY,
+                           starttime, nrows INTEGER DEFAULT 0,
+                           tfirst, tlast, tags DEFAULT '[]')""",
+                   """CREATE TABLE IF NOT EXISTS tags (
+                           id INTEGER PRIMARY KEY,
+                           name UNIQUE)""",
+                   """CREATE TABLE IF NOT EXISTS samples (
+                           session_id REFERENCES sessions (id),
+                           timeseconds)""",
+                   """CREATE INDEX IF NOT EXISTS samples_session_time
+                           ON samples (session_id, timeseconds)""",
+                   """CREATE TABLE IF NOT EXISTS rollupwidths (
+                           width PRIMARY KEY)""",
+                   """CREATE TABLE IF NOT EXISTS rollups (
+                           session_id, tag_id, width, bucket,
+                           n, vmin, vmax, vsum, tfirst, vfirst, tlast, vlast,
+                           PRIMARY KEY (session_id, tag_id, width, bucket))""",
+                   """CREATE TABLE IF NOT EXISTS events (
+                           session_id REFERENCES sessions (id),
+                           timeseconds, name, active, value)""",
+                   """CREATE INDEX IF NOT EXISTS events_session_time
+                           ON events (session_id, timeseconds)"""]
+        for statement in creates:
+            self.cursor.execute(statement)
+        self.db.commit()
+        self.tags = {}
+        self.sessiontags = {}
+        sessioncolumns = [row[1] for row in
+                          self.cursor.execute("PRAGMA table_info(sessions)")]
+        if 'nrows' not in sessioncolumns:
+            for column in ['nrows INTEGER DEFAULT 0', 'tfirst', 'tlast',
+                           "tags DEFAULT '[]'"]:
+                self.cursor.execute(
+                    "ALTER TABLE sessions ADD COLUMN " + column)
+            self.summarise()
+        if self._hastable('tagvalues'):
+            self.migrate()
+        self.rollups = [width for width, in
+                        self.cursor.execute("SELECT width FROM rollupwidths")]
+        for width in rollups:
+            self.add_rollup(width)
+        self.session = None
+
+    def _sync(self, session=None):
+        """Write the buffered rows if session is the current session, so
+        that queries see them.
+
+        Returns session, or the current session if it is None. Queries of
+        earlier sessions do not wait for the writer."""
+        current = self.session
+        if session is None:
+            session = current
+        if session == current and (self.buffer or self.eventbuffer
+                                   or self.pending is not None):
+            self.flush()
+        return session
+
+    def _read(self, query, parameters=()):
+        """Return all rows of a query, run on a reader if there are any"""
+        if not self.readers:
+            with self.lock:
+                return self.cursor.execute(query, parameters).fetchall()
+        with self.available:
+            try:
+                connection = self.pool.pop()
+            except IndexError:
+                uri = 'file:{}?mode=ro'.format(
+                    os.path.abspath(self.filename).replace('?', '%3f'))
+                connection = sqlite3.connect(uri, uri=True,
+                                             check_same_thread=False)
+            try:
+                return connection.execute(query, parameters).fetchall()
+            finally:
+                self.pool.append(connection)
+
+    def _hastable(self, table):
+        query = """SELECT COUNT(*) FROM sqlite_master
+                   WHERE type='table' AND name=?"""
+        return self.cursor.execute(query, (table,)).fetchone()[0] > 0
+
+    def column(self, name, create=False):
+        """Return the samples column storing tag name.
+
+        Returns None for unknown tags unless create is True, in which case
+        the tag is added."""
+        if name in self.tags:
+            return 'tag{}'.format(self.tags[name])
+        with self.lock:
+            # another connection may have added the tag
+            self.tags = dict(self.cursor.execute("SELECT name, id FROM tags"))
+            if name not in self.tags:
+                if not create:
+                    return None
+                self.cursor.execute("INSERT INTO tags (name) VALUES (?)",
+                                    (name,))
+                self.tags[name] = self.cursor.lastrowid
+                self.cursor.execute(
+                    "ALTER TABLE samples ADD COLUMN tag{}".format(
+                        self.tags[name]))
+            return 'tag{}'.format(self.tags[name])
+
+    def migrate(self):
+        """Convert a tagvalues table from an older version to samples rows.
+
+        The conversion is done in a single transaction, after which the
+        tagvalues table is dropped."""
+        names = [name for name, in
+                 self.cursor.execute("SELECT DISTINCT name FROM tagvalues")]
+        columns = [self.column(name, create=True) for name in names]
+        pivot = ', '.join('MAX(CASE WHEN name=? THEN value END)'
+                          for _ in names)
+        query = """INSERT INTO samples (session_id, timeseconds{})
+                   SELECT session_id, timeseconds{} FROM tagvalues
+                   GROUP BY session_id, timeseconds""".format(
+            ''.join(', ' + c for c in columns),
+            ', ' + pivot if names else '')
+        self.cursor.execute(query, names)
+        self.cursor.execute("DROP TABLE tagvalues")
+        self.db.commit()
+        self.summarise()
+
+    def summarise(self):
+        """Recalculate the summaries of all sessions from the samples"""
+        self.flush()
+        self.cursor.execute("""UPDATE sessions SET
+            nrows = (SELECT COUNT(*) FROM samples
+                     WHERE session_id = sessions.id),
+            tfirst = (SELECT MIN(timeseconds) FROM samples
+                      WHERE session_id = sessions.id),
+            tlast = (SELECT MAX(timeseconds) FROM samples
+                     WHERE session_id = sessions.id)""")
+        tags = {}
+        for name, column in self._tagcolumns():
+            query = """SELECT DISTINCT session_id FROM samples
+                       WHERE {} IS NOT NULL""".format(column)
+            for session, in self.cursor.execute(query).fetchall():
+                tags.setdefault(session, []).append(name)
+        self.cursor.execute("UPDATE sessions SET tags = '[]'")
+        self.cursor.executemany("UPDATE sessions SET tags = ? WHERE id = ?",
+                                [(json.dumps(names), session)
+                                 for session, names in tags.items()])
+        self.db.commit()
+        self.sessiontags = {}
+
+    def _tagcolumns(self):
+        """Return (name, column) for all tags, ordered by id"""
+        query = "SELECT name, id FROM tags ORDER BY id"
+        return [(name, 'tag{}'.format(id))
+                for name, id in self.cursor.execute(query).fetchall()]
+
+    def _grouped(self, column, where=''):
+        """Return a query summarising column in buckets of :width"""
+        return """SELECT g.*,
+            (SELECT {0} FROM samples WHERE session_id = g.session_id
+             AND timeseconds = g.tfirst AND {0} IS NOT NULL LIMIT 1) vfirst,
+            (SELECT {0} FROM samples WHERE session_id = g.session_id
+             AND timeseconds = g.tlast AND {0} IS NOT NULL LIMIT 1) vlast
+            FROM (SELECT session_id, {1} AS bucket, COUNT({0}) AS n,
+                         MIN({0}) AS vmin, MAX({0}) AS vmax, SUM({0}) AS vsum,
+                         MIN(timeseconds) AS tfirst, MAX(timeseconds) AS tlast
+                  FROM samples WHERE {0} IS NOT NULL {2}
+                  GROUP BY session_id, bucket) AS g""".format(
+            column, self.bucket, where)
+
+    def add_rollup(self, width):
+        """Start maintaining summaries in buckets of width seconds"""
+        if width <= 0:
+            raise ValueError('Rollup widths must be positive.')
+        with self.lock:
+            if width in self.rollups:
+                return
+            self.flush()
+            for name, column in self._tagcolumns():
+                query = """INSERT INTO rollups
+                           SELECT session_id, :tag, :width, bucket, n,
+                                  vmin, vmax, vsum, tfirst, vfirst, tlast, vlast
+                           FROM ({})""".format(self._grouped(column))
+                self.cursor.execute(query, {'tag': int(column[3:]),
+                                            'width': width})
+            self.cursor.execute("INSERT INTO rollupwidths VALUES (?)",
+                                (width,))
+            self.db.commit()
+            self.rollups.append(width)
+
+    def new_session(self):
+        with self.lock:
+            self.flush()
+            self.cursor.execute("""INSERT INTO SESSIONS (starttime)
+                                   VALUES (datetime('now'))""")
+            self.session = self.cursor.lastrowid
+            self.db.commit()
+
+    def get_sessions(self):
+        """Return a list of (id, starttime, number of rows) of all sessions"""
+        self._sync()
+        query = "SELECT id, starttime, nrows FROM sessions ORDER BY starttime"
+        return self._read(query)
+
+    def session_summary(self, session=None):
+        """Return a dictionary summarising a session"""
+        session = self._sync(session)
+        query = """SELECT id, starttime, nrows, tfirst, tlast, tags
+                   FROM sessions WHERE id=?"""
+        rows = self._read(query, (session,))
+        if not rows:
+            raise KeyError('No session {}'.format(session))
+        id, starttime, nrows, tfirst, tlast, tags = rows[0]
+        return {'id': id,
+                'starttime': starttime,
+                'rows': nrows,
+                'tfirst': tfirst,
+                'tlast': tlast,
+                'duration': tlast - tfirst if nrows else 0,
+                'tags': json.loads(tags)}
+
+    def delete_session(self, session_id):
+        queries = ['DELETE FROM sessions WHERE id = ?',
+                   'DELETE FROM samples WHERE session_id = ?',
+                   'DELETE FROM rollups WHERE session_id = ?',
+                   'DELETE FROM events WHERE session_id = ?']
+        with self.lock:
+            self.flush()
+            for query in queries:
+                self.cursor.execute(query, (session_id,))
+            self.db.commit()
+            self.sessiontags.pop(session_id, None)
+
+    def record(self, timeseconds, name, value):
+        """Record a single value.
+
+        Consecutive values recorded at the same time are combined into one
+        row."""
+        with self.lock:
+            if self.session is None:
+                self.new_session()
+            pending = self.pending
+            if (pending is None or pending[1] != timeseconds
+                    or name in pending[2]):
+                self._push()
+                self.pending = pending = [self.session, timeseconds, [], []]
+                self._check()
+            pending[2].append(name)
+            pending[3].append(value)
+
+    def record_row(self, timeseconds, names, values):
+        """Record the values of several tags at one time."""
+        with self.lock:
+            if self.session is None:
+                self.new_session()
+            self._push()
+            self.buffer.append((self.session, timeseconds,
+                                tuple(names), tuple(values)))
+            self._check()
+
+    def record_event(self, timeseconds, name, active, value=None):
+        """Record that an alarm was raised or cleared.
+
+        Events are buffered and written with the rows."""
+        with self.lock:
+            if self.session is None:
+                self.new_session()
+            self.eventbuffer.append((self.session, timeseconds, name,
+                                     bool(active), value))
+            self._check()
+
+    def get_events(self, session=None):
+        """Return a list of (timeseconds, name, active, value) of the
+        events of a session, ordered by time"""
+        session = self._sync(session)
+        query = """SELECT timeseconds, name, active, value FROM events
+                   WHERE session_id = ? ORDER BY timeseconds, rowid"""
+        return [(t, name, bool(active), value) for t, name, active, value
+                in self._read(query, (session,))]
+
+    def _push(self):
+        """Move the row being built by record into the buffer"""
+        if self.pending is not None:
+            session, timeseconds, names, values = self.pending
+            self.buffer.append((session, timeseconds,
+                                tuple(names), tuple(values)))
+            self.pending = None
+
+    def _check(self):
+        if (len(self.buffer) >= self.buffersize
+                or realtime() - self.lastflush >= self.flushinterval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows to the database in one transaction"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self._push()
+        if self.eventbuffer:
+            self.cursor.executemany("""INSERT INTO events (session_id,
+                                       timeseconds, name, active, value)
+                                       VALUES (?, ?, ?, ?, ?)""",
+                                    self.eventbuffer)
+            self.eventbuffer = []
+            if not self.buffer:
+                self.db.commit()
+        if self.buffer:
+            groups = {}
+            summaries = {}
+            for session, timeseconds, names, values in self.buffer:
+                groups.setdefault(names, []).append(
+                    (session, timeseconds) + values)
+                summary = summaries.get(session)
+                if summary is None:
+                    summaries[session] = [1, timeseconds, timeseconds,
+                                          set(names)]
+                else:
+                    summary[0] += 1
+                    summary[1] = min(summary[1], timeseconds)
+                    summary[2] = max(summary[2], timeseconds)
+                    summary[3].update(names)
+            for names, rows in groups.items():
+                columns = [self.column(name, create=True) for name in names]
+                query = """INSERT INTO samples (session_id, timeseconds{})
+                           VALUES (?, ?{})""".format(
+                    ''.join(', ' + c for c in columns),
+                    ', ?' * len(columns))
+                self.cursor.executemany(query, rows)
+            for session, (nrows, tfirst, tlast, names) in summaries.items():
+                self._summarise(session, nrows, tfirst, tlast, names)
+            if self.rollups:
+                self._rollup()
+            self.db.commit()
+            self.buffer = []
+        self.lastflush = realtime()
+
+    def _rollup(self):
+        """Add the buffered rows to the rollups"""
+        buckets = {}
+        for session, timeseconds, names, values in self.buffer:
+            for name, value in zip(names, values):
+                if not isinstance(value, (int, float)):
+                    continue
+                for width in self.rollups:
+                    key = (session, self.tags[name], width,
+                           math.floor(timeseconds / width))
+                    b = buckets.get(key)
+                    if b is None:
+                        buckets[key] = [1, value, value, value,
+                                        timeseconds, value, timeseconds, value]
+                        continue
+                    b[0] += 1
+                    b[1] = min(b[1], value)
+                    b[2] = max(b[2], value)
+                    b[3] += value
+                    if timeseconds < b[4]:
+                        b[4:6] = timeseconds, value
+                    if timeseconds >= b[6]:
+                        b[6:8] = timeseconds, value
+        query = """INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (session_id, tag_id, width, bucket) DO UPDATE SET
+                       n = n + excluded.n,
+                       vmin = MIN(vmin, excluded.vmin),
+                       vmax = MAX(vmax, excluded.vmax),
+                       vsum = vsum + excluded.vsum,
+                       vfirst = CASE WHEN excluded.tfirst < tfirst
+                                THEN excluded.vfirst ELSE vfirst END,
+                       tfirst = MIN(tfirst, excluded.tfirst),
+                       vlast = CASE WHEN excluded.tlast >= tlast
+                               THEN excluded.vlast ELSE vlast END,
+                       tlast = MAX(tlast, excluded.tlast)"""
+        self.cursor.executemany(query, [key + tuple(b)
+                                        for key, b in buckets.items()])
+
+    def _summarise(self, session, nrows, tfirst, tlast, names):
+        """Add newly written rows to the summary of a session"""
+        tags = self.sessiontags.get(session)
+        if tags is None:
+            query = "SELECT tags FROM sessions WHERE id=?"
+            row = self.cursor.execute(query, (session,)).fetchone()
+            tags = json.loads(row[0]) if row else []
+            self.sessiontags[session] = tags
+        newtags = [name for name in sorted(names) if name not in tags]
+        tags.extend(newtags)
+        query = """UPDATE sessions SET nrows = nrows + ?,
+                       tfirst = MIN(COALESCE(tfirst, ?), ?),
+                       tlast = MAX(COALESCE(tlast, ?), ?)"""
+        parameters = [nrows, tfirst, tfirst, tlast, tlast]
+        if newtags:
+            query += ", tags = ?"
+            parameters.append(json.dumps(tags))
+        self.cursor.execute(query + " WHERE id = ?", parameters + [session])
+
+    def get(self, name, timeseconds=None, session=None):
+        session = self._sync(session)
+        column = self.column(name)
+        if column is None:
+            return []
+        query = """SELECT timeseconds, {0} FROM samples
+                   WHERE session_id=? AND {0} IS NOT NULL""".format(column)
+        parameters = [session]
+        if timeseconds is not None:
+            query += " and timeseconds=?"
+            parameters.append(timeseconds)
+        query += " ORDER BY timeseconds"
+        return self._read(query, parameters)
+
+    def get_session(self, names, session=None, tstart=None, tend=None):
+        """Return a list of (timeseconds, value, ...) rows with the values
+        of the named tags in a session, ordered by time.
+
+        If tstart or tend is given, only rows at times tstart <= t < tend
+        are returned."""
+        session = self._sync(session)
+        columns = [self.column(name) or 'NULL' for name in names]
+        query = """SELECT timeseconds{} FROM samples
+                   WHERE session_id = ?""".format(
+            ''.join(', ' + c for c in columns))
+        parameters = [session]
+        if tstart is not None:
+            query += " AND timeseconds >= ?"
+            parameters.append(tstart)
+        if tend is not None:
+            query += " AND timeseconds < ?"
+            parameters.append(tend)
+        query += " ORDER BY timeseconds, rowid"
+        return self._read(query, parameters)
+
+    def last_time(self, t, session=None):
+        """Return the last time at or before t in a session, or None"""
+        session = self._sync(session)
+        query = """SELECT MAX(timeseconds) FROM samples
+                   WHERE session_id = ? AND timeseconds <= ?"""
+        return self._read(query, (session, t))[0][0]
+
+    def get_chunk(self, names, session=None, after=None, size=1000):
+        """Return up to size rows of a session like get_session, starting
+        after a position.
+
+        Returns the rows and the position of the last row, which is passed
+        as after to get the next chunk. after is None for the first chunk."""
+        session = self._sync(session)
+        columns = [self.column(name) or 'NULL' for name in names]
+        query = """SELECT timeseconds, rowid{} FROM samples
+                   WHERE session_id = ?""".format(
+            ''.join(', ' + c for c in columns))
+        parameters = [session]
+        if after is not None:
+            query += " AND (timeseconds, rowid) > (?, ?)"
+            parameters.extend(after)
+        query += " ORDER BY timeseconds, rowid LIMIT ?"
+        parameters.append(size)
+        rows = self._read(query, parameters)
+        if not rows:
+            return [], after
+        return [row[:1] + row[2:] for row in rows], rows[-1][:2]
+
+    def iter_session(self, names, session=None, chunksize=1000):
+        """Iterate over the rows of a session in lists of chunksize rows"""
+        return _chunks(self.get_chunk, (names, session), chunksize)
+
+    def get_sessions_chunk(self, names, sessions, after=None, size=1000):
+        """Return up to size rows of several sessions, starting after a
+        position, like get_chunk.
+
+        The rows are (session id, timeseconds, value, ...), ordered by
+        session and time, and are read with a single query."""
+        sessions = list(sessions)
+        if self.session in sessions:
+            self._sync()
+        columns = [self.column(name) or 'NULL' for name in names]
+        query = """SELECT session_id, timeseconds, rowid{} FROM samples
+                   WHERE session_id IN ({})""".format(
+            ''.join(', ' + c for c in columns),
+            ', '.join('?' * len(sessions)))
+        parameters = sessions
+        if after is not None:
+            query += " AND (session_id, timeseconds, rowid) > (?, ?, ?)"
+            parameters.extend(after)
+        query += " ORDER BY session_id, timeseconds, rowid LIMIT ?"
+        parameters.append(size)
+        rows = self._read(query, parameters)
+        if not rows:
+            return [], after
+        return [row[:2] + row[3:] for row in rows], rows[-1][:3]
+
+    def iter_sessions(self, names, sessions, chunksize=1000):
+        """Iterate over the rows of several sessions in lists of chunksize
+        rows"""
+        return _chunks(self.get_sessions_chunk, (names, sessions), chunksize)
+
+    def downsample(self, name, width, tstart=None, tend=None, session=None):
+        """Summarise the values of a tag in buckets of width seconds.
+
+        Buckets start at whole multiples of width. If tstart or tend is
+        given, only values at times tstart <= t < tend are included.
+
+        Returns a list of (bucket start time, min, max, mean, first, last,
+        number of values) for the buckets containing values, ordered by
+        time. The rollups are used when width is one of the rollup widths
+        and tstart and tend are multiples of it."""
+        session = self._sync(session)
+        column = self.column(name)
+        if column is None:
+            return []
+        parameters = {'session': session, 'width': width,
+                      'tstart': tstart, 'tend': tend,
+                      'tag': self.tags[name]}
+        if width in self.rollups and all(t is None or t % width == 0
+                                         for t in (tstart, tend)):
+            where = ''
+            if tstart is not None:
+                where += ' AND bucket >= :tstart / :width'
+            if tend is not None:
+                where += ' AND bucket < :tend / :width'
+            query = """SELECT bucket * :width, vmin, vmax, vsum * 1.0 / n,
+                              vfirst, vlast, n
+                       FROM rollups WHERE session_id = :session
+                       AND tag_id = :tag AND width = :width {}
+                       ORDER BY bucket""".format(where)
+        else:
+            where = 'AND session_id = :session'
+            if tstart is not None:
+                where += ' AND timeseconds >= :tstart'
+            if tend is not None:
+                where += ' AND timeseconds < :tend'
+            query = """SELECT bucket * :width, vmin, vmax, vsum * 1.0 / n,
+                              vfirst, vlast, n
+                       FROM ({}) ORDER BY bucket""".format(
+                self._grouped(column, where))
+        return self._read(query, parameters)
+
+    def clean(self):
+        """Delete sessions with no associated points"""
+        with self.lock:
+            self.flush()
+            query = "DELETE FROM sessions WHERE nrows = 0"
+            self.cursor.execute(query)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.clean()
+            self.db.close()
+            for connection in self.pool:
+                connection.close()
+
+
+class BackgroundWriter(object):
+    """Run a TagDB on a dedicated writer thread
+
+    The TagDB is created and used only by the writer thread. Rows passed to
+    `record_row` are put on a queue and written by the thread, so the
+    caller never waits for SQLite. Other TagDB methods can be called on the
+    writer as usual: they are run on the thread after the rows recorded
+    before them, and the caller waits for the result.
+
+    With `readers`, queries like `get` or `session_summary` are instead run
+    on the calling thread with a read-only connection, so they neither wait
+    for the queue nor hold up the writer. They see the rows which have been
+    written; call `flush` first to include the rows still queued.
+
+    When more than `queuesize` rows are waiting, the overflow policy
+    decides what happens to a new row:
+
+    - 'block': wait until the writer has caught up
+    - 'drop': drop the oldest waiting row
+    - 'spill': write the row to a temporary file, which the writer thread
+      reads back once it has written the rows queued before it, so that
+      neither the caller nor memory use is held up
+
+    `metrics` reports the queue depth, the numbers of rows written, dropped
+    and spilled, and the write lag: the time between recording a row and
+    committing it to the database.
+    """
+    overflow_policies = ('block', 'drop', 'spill')
+    queries = ('get_sessions', 'session_summary', 'get_events', 'get',
+               'get_session', 'last_time', 'get_chunk', 'get_sessions_chunk',
+               'downsample')
+
+    def __init__(self, filename=":memory:", queuesize=1000, overflow='block',
+                 **options):
+        """:param filename: The filename of the database.
+        :param queuesize: Number of rows which may wait to be written.
+        :param overflow: What to do with rows which do not fit in the queue.
+        :param options: Passed on to TagDB."""
+        if overflow not in self.overflow_policies:
+            raise ValueError('overflow must be one of '
+                             + ', '.join(self.overflow_policies))
+        self.queuesize = queuesize
+        self.overflow = overflow
+        self.items = deque()
+        self.nrows = 0
+        self.condition = threading.Condition()
+        self.error = None
+        self.closed = False
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.spillfile = None
+        self.spillread = 0
+        self.segment = None
+        self.maxdepth = 0
+        self.lag = 0
+        self.maxlag = 0
+        self.tagdb = None
+        self.thread = threading.Thread(target=self._run, name='TagDB writer',
+                                       args=(filename, options))
+        self.thread.daemon = True
+        self.thread.start()
+        self.call(lambda: None)
+
+    def _put(self, item):
+        with self.condition:
+            # rows recorded from now on are queued after this item
+            self.segment = None
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def record_row(self, timeseconds, names, values):
+        """Queue a row to be recorded by the writer thread"""
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            if self.closed:
+                raise RuntimeError('The writer has been closed.')
+            if self.segment is None and self.nrows >= self.queuesize:
+                if self.overflow == 'block':
+                    while (self.nrows >= self.queuesize
+                           and self.error is None):
+                        self.condition.wait()
+                elif self.overflow == 'drop':
+                    for item in self.items:
+                        if item[0] == 'row':
+                            self.items.remove(item)
+                            self.nrows -= 1
+                            self.dropped += 1
+                            break
+                else:
+                    self.segment = [0]
+                    self.items.append(('spill', self.segment, None))
+            if self.segment is not None:
+                self._spill((timeseconds, names, values, realtime()))
+            else:
+                self.items.append(('row', (timeseconds, names, values),
+                                   realtime()))
+                self.nrows += 1
+                self.maxdepth = max(self.maxdepth, self.nrows)
+            self.condition.notify_all()
+
+    def _spill(self, row):
+        """Append a row to the spill file, in the segment of rows which
+        the last 'spill' item in the queue stands for"""
+        if self.spillfile is None:
+            self.spillfile = tempfile.TemporaryFile()
+        self.spillfile.seek(0, 2)
+        pickle.dump(row, self.spillfile, pickle.HIGHEST_PROTOCOL)
+        self.segment[0] += 1
+        self.spilled += 1
+
+    def _replay(self, segment):
+        """Iterate over the rows of a segment of the spill file"""
+        with self.condition:
+            if self.segment is segment:
+                # caught up: record_row queues rows again
+                self.segment = None
+        for _ in range(segment[0]):
+            with self.condition:
+                self.spillfile.seek(self.spillread)
+                row = pickle.load(self.spillfile)
+                self.spillread = self.spillfile.tell()
+            yield row
+        with self.condition:
+            self.spillfile.seek(0, 2)
+            if self.spillread == self.spillfile.tell():
+                self.spillfile.seek(0)
+                self.spillfile.truncate()
+                self.spillread = 0
+
+    def record_event(self, timeseconds, name, active, value=None):
+        """Queue an alarm event to be recorded by the writer thread"""
+        if self.closed:
+            raise RuntimeError('The writer has been closed.')
+        self._put(('event', (timeseconds, name, active, value), None))
+
+    def call(self, function, *args, **kwargs):
+        """Run function on the writer thread and return its result"""
+        done = threading.Event()
+        result = []
+        if self.closed:
+            raise RuntimeError('The writer has been closed.')
+        self._put(('call', (function, args, kwargs, done, result), None))
+        done.wait()
+        value, error = result
+        if error is not None:
+            raise error
+        return value
+
+    def _run(self, filename, options):
+        try:
+            self.tagdb = TagDB(filename, **options)
+        except Exception as error:
+            self.error = error
+        while True:
+            with self.condition:
+                while not self.items:
+                    self.condition.wait()
+                batch = list(self.items)
+                self.items.clear()
+                self.nrows = 0
+                self.condition.notify_all()
+            rows = []
+            for kind, payload, queued in batch:
+                if kind == 'spill':
+                    for row in self._replay(payload):
+                        rows.append(row[3])
+                        if self.error is None:
+                            self._write(row[:3])
+                    continue
+                if kind == 'event':
+                    if self.error is None:
+                        try:
+                            self.tagdb.record_event(*payload)
+                        except Exception as error:
+                            self.error = error
+                    continue
+                if kind == 'row':
+                    rows.append(queued)
+                    if self.error is None:
+                        self._write(payload)
+                    continue
+                if rows:
+                    self._commit(rows)
+                    rows = []
+                function, args, kwargs, done, result = payload
+                if self.error is not None:
+                    result[:] = [None, self.error]
+                else:
+                    try:
+                        result[:] = [function(*args, **kwargs), None]
+                    except Exception as error:
+                        result[:] = [None, error]
+                done.set()
+                if kind == 'stop':
+                    return
+            if rows:
+                self._commit(rows)
+
+    def _write(self, row):
+        try:
+            self.tagdb.record_row(*row)
+        except Exception as error:
+            self.error = error
+
+    def _commit(self, queued):
+        """Flush the TagDB and update the metrics for the rows queued"""
+        if self.error is None:
+            try:
+                self.tagdb.flush()
+            except Exception as error:
+                self.error = error
+                return
+        lag = realtime() - queued[0]
+        self.lag = lag
+        self.maxlag = max(self.maxlag, lag)
+        self.written += len(queued)
+
+    def metrics(self):
+        """Return a dictionary describing the state of the writer"""
+        with self.condition:
+            return {'depth': self.nrows,
+                    'maxdepth': self.maxdepth,
+                    'written': self.written,
+                    'dropped': self.dropped,
+                    'spilled': self.spilled,
+                    'lag': self.lag,
+                    'maxlag': self.maxlag}
+
+    @property
+    def session(self):
+        return self.call(lambda: self.tagdb.session)
+
+    @session.setter
+    def session(self, session):
+        self.call(setattr, self.tagdb, 'session', session)
+
+    def iter_session(self, names, session=None, chunksize=1000):
+        """Iterate over the rows of a session, reading every chunk with
+        get_chunk"""
+        return _chunks(self.get_chunk, (names, session), chunksize)
+
+    def iter_sessions(self, names, sessions, chunksize=1000):
+        """Iterate over the rows of several sessions, reading every chunk
+        with get_sessions_chunk"""
+        return _chunks(self.get_sessions_chunk, (names, sessions), chunksize)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.tagdb, name)
+        if not callable(attribute) or (name in self.queries
+                                       and self.tagdb.readers):
+            return attribute
+
+        def method(*args, **kwargs):
+            return self.call(attribute, *args, **kwargs)
+        return method
+
+    def close(self):
+        """Write all queued rows, close the TagDB and stop the thread"""
+        if self.closed:
+            return
+        done = threading.Event()
+        result = []
+        self._put(('stop', (lambda: self.tagdb.close(), (), {}, done, result),
+                   None))
+        self.closed = True
+        done.wait()
+        self.thread.join()
+        if self.spillfile is not None:
+            self.spillfile.close()
+        if result[1] is not None:
+            raise result[1]
@@ -7,7 +7,7 @@ import os
 import random
 import serial
 from serial.tools import list_ports
-from .labtime import labtime
+from .labtime import labtime as default_labtime
 from .version import __version__
 
 
@@ -52,9 +52,10 @@ class AlreadyConnectedError(Exception):
 
 
 class TCLab(object):
-    def __init__(self, port='', debug=False):
+    def __init__(self, port='', debug=False, labtime=None):
         global _connected
         self.debug = debug
+        self.labtime = default_labtime if labtime is None else labtime
         print("TCLab version", __version__)
         self.port, self.arduino = find_arduino(port)
         if self.port is None:
@@ -82,8 +83,9 @@ class TCLab(object):
             print(self.arduino, 'connected on port', self.port,
                   'at', self.baud, 'baud.')
             print(self.version + '.')
-        labtime.set_rate(1)
-        labtime.start()
+        self.labtime.set_virtual(False)
+        self.labtime.set_rate(1)
+        self.labtime.start()
         self._P1 = 200.0
         self._P2 = 100.0
         self.Q2(0)
@@ -219,14 +221,15 @@ class TCLab(object):
 
 
 class TCLabModel(object):
-    def __init__(self, port='', debug=False, synced=True):
+    def __init__(self, port='', debug=False, synced=True, labtime=None):
         self.debug = debug
         self.synced = synced
+        self.labtime = default_labtime if labtime is None else labtime
         print("TCLab version", __version__)
-        labtime.start()
+        self.labtime.start()
         print('Simulated TCLab')
         self.Ta = 21                  # ambient temperature
-        self.tstart = labtime.time()  # start time
+        self.tstart = self.labtime.time()  # start time
         self.tlast = self.tstart      # last update time
         self._P1 = 200.0              # max power heater 1
         self._P2 = 100.0              # max power heater 2
@@ -343,7 +346,7 @@ class TCLabModel(object):
     def update(self, t=None):
         if t is None:
             if self.synced:
-                self.tnow = labtime.time() - self.tstart
+                self.tnow = self.labtime.time() - self.tstart
             else:
                 return
         else:
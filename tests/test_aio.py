@@ -0,0 +1,107 @@
+import sys
+import time
+
+import pytest
+
+# the tests use async comprehensions, which are new in Python 3.6
+if sys.version_info < (3, 6):
+    pytest.skip("the asyncio tests need Python 3.6", allow_module_level=True)
+
+import asyncio
+
+from tclab import Historian, Labtime, TCLabModel, aclock, asubscribe
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def collect(clock):
+    return [t async for t in clock]
+
+
+def test_aclock():
+    lt = Labtime()
+    lt.set_rate(5)
+    times = run(collect(aclock(3, labtime=lt)))
+    assert [round(t) for t in times] == [0, 1, 2, 3]
+
+
+def test_aclock_virtual():
+    lt = Labtime(virtual=True)
+    tic = time.time()
+    times = run(collect(aclock(3600, labtime=lt)))
+    assert time.time() - tic < 10
+    assert times == list(range(3601))
+
+
+def test_aclock_tolerance():
+    lt = Labtime()
+    lt.set_rate(5)
+
+    async def loop():
+        async for t in aclock(5, tol=0.25, adaptive=False, labtime=lt):
+            if 0.5 < t < 2.5:
+                time.sleep(1.5 / 5)
+
+    with pytest.raises(RuntimeError):
+        run(loop())
+
+
+def test_aclock_concurrent():
+    """Several loops share one event loop without a thread each."""
+    async def control(lab, lt):
+        async for t in aclock(2, 0.5, labtime=lt, adaptive=False):
+            lab.Q1(100)
+        return lab.T1
+
+    async def main():
+        loops = []
+        for _ in range(5):
+            lt = Labtime()
+            lt.set_rate(2)
+            loops.append(control(TCLabModel(labtime=lt), lt))
+        return await asyncio.gather(*loops)
+
+    tic = time.time()
+    results = run(main())
+    assert len(results) == 5
+    assert time.time() - tic < 2
+
+
+def test_asubscribe():
+    h = Historian([('a', lambda: 2 * h.tnow)], dbfile=None)
+
+    async def produce(subscription):
+        for t in range(5):
+            h.update(t)
+            await asyncio.sleep(0)
+        subscription.close()
+
+    async def consume():
+        subscription = asubscribe(h, ['a'], maxlen=10)
+        asyncio.ensure_future(produce(subscription))
+        return [row async for row in subscription]
+
+    assert run(consume()) == [(0,), (2,), (4,), (6,), (8,)]
+    assert h.subscriptions == []
+
+
+def test_asubscribe_historian_close():
+    h = Historian([('a', lambda: h.tnow)], dbfile=None)
+
+    async def produce():
+        h.update(0)
+        await asyncio.sleep(0)
+        h.close()
+
+    async def consume():
+        subscription = asubscribe(h)
+        asyncio.ensure_future(produce())
+        return [row async for row in subscription]
+
+    assert run(consume()) == [(0, 0)]
@@ -0,0 +1,73 @@
+import pytest
+
+from tclab import Historian
+from tclab.alarms import High, Low, Rate, Stuck, Invalid
+
+
+def run(rule, points):
+    return [rule.add(t, v) for t, v in points]
+
+
+def test_high_low():
+    high = High('T1', 60, deadband=2)
+    assert high.name == 'T1 high'
+    values = [50, 61, 59, 62, 57, 61]
+    assert run(high, enumerate(values)) == [None, True, None, None, False,
+                                            True]
+    low = Low('T1', 10, deadband=1, name='cold')
+    assert run(low, enumerate([12, 9, 10.5, 11.5, None])) == [
+        None, True, None, False, None]
+    assert not low.active
+    with pytest.raises(ValueError):
+        High('T1', 60, deadband=-1)
+
+
+def test_rate():
+    rate = Rate('T1', 1, deadband=0.5)
+    points = [(0, 20), (1, 20.5), (2, 22), (3, 22.8), (4, 23)]
+    assert run(rate, points) == [None, None, True, None, False]
+
+
+def test_stuck():
+    stuck = Stuck('T1', 3, tolerance=0.1)
+    points = [(0, 20), (1, 20.05), (2, 20), (3, 20.08), (4, 20.5), (5, 20.5)]
+    assert run(stuck, points) == [None, None, None, True, False, None]
+
+
+def test_invalid():
+    invalid = Invalid('T1')
+    assert run(invalid, enumerate([1, None, None, 2])) == [
+        None, True, None, False]
+
+
+def test_historian_alarms(tmpdir):
+    values = [20, 65, 70, 50, None]
+    h = Historian([('T1', lambda: values[int(h.tnow)])],
+                  dbfile=str(tmpdir.join('alarms.db')),
+                  alarms=[High('T1', 60, deadband=5), Invalid('T1')])
+    for t in range(3):
+        h.update(t)
+    assert h.active_alarms() == ['T1 high']
+    for t in range(3, 5):
+        h.update(t)
+    assert h.active_alarms() == ['T1 invalid']
+    events = [(1, 'T1 high', True, 65), (3, 'T1 high', False, 50),
+              (4, 'T1 invalid', True, None)]
+    assert h.events == events
+    h.new_session()
+    assert h.events == []
+    assert h.db.get_events(1) == events
+    h.load_session(1)
+    assert h.events == events
+    h.db.delete_session(1)
+    assert h.db.get_events(1) == []
+    with pytest.raises(ValueError):
+        Historian([('T1', lambda: 1)], alarms=[High('T2', 1)])
+
+
+def test_background_events():
+    h = Historian([('T1', lambda: 70)], background=True,
+                  alarms=[High('T1', 60)])
+    h.update(0)
+    assert h.db.get_events() == [(0, 'T1 high', True, 70)]
+    h.close()
@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from tclab.columns import ArrayColumn
+
+
+def test_grow():
+    c = ArrayColumn(initial=2)
+    c.extend(range(10))
+    assert len(c) == 10
+    assert len(c.data) == 16
+    assert list(c) == list(range(10))
+    assert c[-1] == 9
+
+
+def test_views_survive_growth():
+    c = ArrayColumn(initial=2)
+    c.extend([1, 2])
+    view = c[:]
+    c.append(3)
+    assert list(view) == [1, 2]
+
+
+def test_ring():
+    c = ArrayColumn(capacity=4)
+    c.extend(range(6))
+    assert list(c) == [2, 3, 4, 5]
+    assert c.view().flags['C_CONTIGUOUS']
+    assert np.shares_memory(c[1:3], c.data)
+    assert c.bisect(3) == 2
+
+
+def test_missing_values():
+    c = ArrayColumn()
+    c.append(None)
+    assert np.isnan(c[0])
+
+
+def test_capacity_validation():
+    with pytest.raises(ValueError):
+        ArrayColumn(capacity=0)
+
+
+def test_set_array():
+    values = np.arange(3.0)
+    values.flags.writeable = False
+    c = ArrayColumn()
+    c.set_array(values)
+    assert np.shares_memory(c[:], values)
+    c.append(3)
+    assert list(c) == [0, 1, 2, 3]
+    assert list(values) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        ArrayColumn(capacity=2).set_array(values)
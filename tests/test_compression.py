@@ -0,0 +1,72 @@
+import math
+
+import pytest
+
+from tclab.compression import Deadband, SwingingDoor
+from tclab.columns import CompressedColumn
+
+
+def noisy(n):
+    """A slow ramp and a step with a little quantisation noise"""
+    values = []
+    for t in range(n):
+        v = 20 + 0.05 * t if t < n // 2 else 40
+        values.append(round(v + 0.1 * math.sin(7 * t), 1))
+    return values
+
+
+def compress(policy, values):
+    times = []
+    column = CompressedColumn(times, policy)
+    for t, value in enumerate(values):
+        times.append(t)
+        column.append(value)
+    column.close()
+    return column
+
+
+@pytest.mark.parametrize('policy', [Deadband(0.5), SwingingDoor(0.5)])
+def test_reconstruction(policy):
+    values = noisy(400)
+    column = compress(policy, values)
+    assert len(column) == len(values)
+    assert len(column.archivetimes) < len(values) / 5
+    assert all(abs(a - b) <= 0.5 + 1e-9 for a, b in zip(column, values))
+    assert column[0] == values[0]
+    assert column[-1] == values[-1]
+
+
+def test_deadband():
+    policy = Deadband(1)
+    decisions = [policy.add(t, v) for t, v in enumerate([0, 0.5, 1, 1.5, 0.8])]
+    assert decisions == [(False, True), (False, False), (False, False),
+                         (False, True), (False, False)]
+    assert policy.close()
+    with pytest.raises(ValueError):
+        Deadband(-1)
+
+
+def test_swinging_door():
+    policy = SwingingDoor(0.1)
+    points = [(0, 0), (1, 1), (2, 2), (3, 3), (4, 3), (5, 3)]
+    decisions = [policy.add(t, v) for t, v in points]
+    assert decisions == [(False, True), (False, False), (False, False),
+                         (False, False), (True, False), (False, False)]
+    assert policy.close()
+
+
+def test_not_numbers():
+    column = compress(SwingingDoor(1), [1, 2, None, 3, 4, 5])
+    assert column.archivetimes == [0, 1, 2, 3, 5]
+    assert column[:] == [1, 2, None, 3, 4, 5]
+
+
+def test_restore():
+    column = compress(SwingingDoor(0.5), noisy(100))
+    times = []
+    restored = CompressedColumn(times, SwingingDoor(0.5))
+    archived = dict(zip(column.archivetimes, column.archivevalues))
+    for t in range(100):
+        times.append(t)
+        restored.restore(archived.get(t))
+    assert restored[:] == column[:]
@@ -0,0 +1,102 @@
+import math
+import random
+
+import pytest
+
+from tclab import Historian
+from tclab.derived import (EMA, Derivative, Integral, RollingMean,
+                           RollingVariance, RunningMax, RunningMin)
+
+random.seed(3)
+times = [0.5 * k + random.random() * 0.4 for k in range(200)]
+values = [random.gauss(20, 5) for _ in times]
+
+
+def run(tag):
+    return [tag.add(t, v) for t, v in zip(times, values)]
+
+
+def windows(n=None, seconds=None):
+    """The values in the window of every value, calculated directly"""
+    result = []
+    for k, t in enumerate(times):
+        if n is not None:
+            result.append(values[max(k - n + 1, 0):k + 1])
+        else:
+            result.append([v for s, v in zip(times[:k + 1], values)
+                           if s > t - seconds])
+    return result
+
+
+def variance(window, ddof=0):
+    mean = sum(window) / len(window)
+    return sum((v - mean) ** 2 for v in window) / (len(window) - ddof)
+
+
+@pytest.mark.parametrize('window', [dict(n=1), dict(n=7), dict(seconds=4.2)])
+def test_rolling(window):
+    expected = windows(**window)
+    mean = run(RollingMean('x', **window))
+    var = run(RollingVariance('x', ddof=0, **window))
+    assert mean == pytest.approx([sum(w) / len(w) for w in expected])
+    assert var == pytest.approx([variance(w) for w in expected], abs=1e-9)
+    assert run(RunningMax('x', **window)) == [max(w) for w in expected]
+    assert run(RunningMin('x', **window)) == [min(w) for w in expected]
+
+
+def test_unbounded():
+    assert run(RunningMax('x')) == [max(values[:k + 1])
+                                    for k in range(len(values))]
+    assert run(RollingMean('x'))[-1] == pytest.approx(
+        sum(values) / len(values))
+    var = RollingVariance('x', n=3, ddof=1)
+    assert var.add(0, 1) is None
+    assert var.add(1, 3) == 2
+
+
+def test_ema():
+    ema = EMA('x', alpha=0.5)
+    assert [ema.add(t, v) for t, v in [(0, 0), (1, 4), (2, 4)]] == [0, 2, 3]
+    ema = EMA('x', tau=2)
+    ema.add(0, 0)
+    assert ema.add(2, 1) == pytest.approx(1 - math.exp(-1))
+    with pytest.raises(ValueError):
+        EMA('x')
+    with pytest.raises(ValueError):
+        EMA('x', alpha=2)
+
+
+def test_derivative_integral():
+    d, i = Derivative('x'), Integral('x', initial=1)
+    points = [(0, 0), (1, 2), (3, 2), (4, None), (5, 0)]
+    assert [d.add(t, v) for t, v in points] == [None, 2, 0, None, -1]
+    assert [i.add(t, v) for t, v in points] == [1, 2, 6, None, 8]
+    i.reset()
+    assert i.add(0, 5) == 1
+
+
+def test_window_validation():
+    with pytest.raises(ValueError):
+        RollingMean('x', n=2, seconds=1)
+    with pytest.raises(ValueError):
+        RunningMax('x', n=0)
+
+
+def test_historian_derived():
+    h = Historian([('a', lambda: 2 * h.tnow)],
+                  derived=[('a.mean', RollingMean('a', n=2)),
+                           ('a.rate', Derivative('a')),
+                           ('a.rate.max', RunningMax('a.rate'))])
+    for t in range(4):
+        h.update(t)
+    assert h.columns == ['Time', 'a', 'a.mean', 'a.rate', 'a.rate.max']
+    assert h.log[-1] == (3, 6, 5, 2, 2)
+    assert h.logdict['a.mean'] == [0, 1, 3, 5]
+    h.new_session()
+    h.update(0)
+    assert h.logdict['a.rate'] == [None]
+    assert h.db.get('a.mean', session=1)[-1] == (3, 5)
+    with pytest.raises(ValueError):
+        Historian([('a', lambda: 1)], derived=[('b', EMA('x', alpha=1))])
+    with pytest.raises(ValueError):
+        Historian([('a', lambda: 1)], derived=[('a', EMA('a', alpha=1))])
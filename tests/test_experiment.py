@@ -23,3 +23,53 @@ def test_runexperiment():
         pass
 
     runexperiment(function, connected=False, plot=False, time=5)
+
+
+def test_experiment_virtual():
+    import time
+    tic = time.time()
+    with Experiment(connected=False, plot=False, time=3600,
+                    virtual=True) as experiment:
+        for t in experiment.clock():
+            experiment.lab.Q1(100 if t < 1800 else 0)
+    assert time.time() - tic < 30
+    assert experiment.historian.t[-1] == 3600
+    assert max(experiment.historian.logdict['T1']) > 30
+
+
+def test_experiment_virtual_restores_labtime():
+    from tclab import labtime
+    with Experiment(connected=False, plot=False, time=5, virtual=True):
+        assert labtime.virtual
+    assert not labtime.virtual
+
+
+def test_experiment_virtual_connected():
+    with pytest.raises(ValueError):
+        Experiment(connected=True, virtual=True)
+
+
+def test_parallel_experiments():
+    import threading
+    from tclab import Labtime
+
+    experiments = []
+
+    def run(Q):
+        with Experiment(connected=False, plot=False, time=600, virtual=True,
+                        labtime=Labtime()) as experiment:
+            for t in experiment.clock():
+                experiment.lab.Q1(Q)
+        experiments.append((Q, experiment))
+
+    threads = [threading.Thread(target=run, args=(Q,)) for Q in (0, 100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = dict(experiments)
+    assert results[0].historian.t == results[100].historian.t
+    assert results[0].historian.t[-1] == 600
+    assert max(results[0].historian.logdict['T1']) < 22
+    assert max(results[100].historian.logdict['T1']) > 30
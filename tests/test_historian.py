@@ -138,3 +138,577 @@ def test_to_csv(tmpdir):
     assert len(lines) == 3
     assert lines[0] == h.columns
     assert lines[1:] == [[str(i) for i in line] for line in h.log]
+
+
+def make_sessions(**options):
+    h = Historian(sources=[('a', lambda: h.tnow * 10),
+                           ('b', lambda: -h.tnow)], **options)
+    for t in range(25):
+        h.update(t)
+    h.new_session()
+    for t in range(10):
+        h.update(t)
+    return h
+
+
+def test_to_csv_sessions(tmpdir):
+    import csv
+    import gzip
+    h = make_sessions()
+    outfile = str(tmpdir.join('test.csv.gz'))
+    h.to_csv(outfile, sessions=[1, 2], columns=['b'], chunksize=7)
+    with gzip.open(outfile, 'rt') as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == ['Session', 'Time', 'b']
+    assert len(lines) == 36
+    assert lines[25] == ['1', '24', '-24']
+    assert lines[26] == ['2', '0', '0']
+
+
+def test_export_compressed(tmpdir):
+    np = pytest.importorskip('numpy')
+    from tclab import Deadband, SwingingDoor
+    values = [0, 0.05, 0, 1, 2, 3, 3, 3, 2, 1, 1, 1]
+    h = Historian([('a', lambda: values[int(h.tnow)]),
+                   ('b', lambda: values[int(h.tnow)]),
+                   ('c', lambda: h.tnow)],
+                  compression={'a': Deadband(0.1), 'b': SwingingDoor(0.1)})
+    for t in range(len(values)):
+        h.update(t)
+    expected = h.to_numpy()
+    h.new_session()
+    outfile = str(tmpdir.join('test.npy'))
+    for chunksize in [1, 3, 100]:
+        h.to_npy(outfile, sessions=[1], chunksize=chunksize)
+        data = np.load(outfile)
+        assert data[:, 1:].tolist() == expected.tolist()
+    outfile = str(tmpdir.join('test.csv'))
+    h.to_csv(outfile, sessions=[1], chunksize=2)
+    with open(outfile) as f:
+        lines = f.read().splitlines()
+    assert lines[2] == '1,1,0,0.0,1'
+    assert lines[5] == '1,4,2,2.0,4'
+
+
+def test_load_sessions():
+    np = pytest.importorskip('numpy')
+    h = make_sessions()
+    h.new_session()
+    grid, data = h.load_sessions([1, 2, 3], chunksize=4)
+    assert grid.tolist() == list(range(25))
+    assert data[1][:, 0].tolist() == [10 * t for t in range(25)]
+    assert data[2][:, 1].tolist() == [-t for t in range(10)] + [-9] * 15
+    assert np.isnan(data[3]).all()
+    grid, data = h.load_sessions([2, 1], ['a'], grid=[-1, 0.5, 9.5, 10.5],
+                                 method='linear', stacked=True)
+    assert data.shape == (2, 4, 1)
+    assert data[:, :, 0].tolist() == [[0, 5, 90, 90], [0, 5, 95, 105]]
+    with pytest.raises(KeyError):
+        h.load_sessions([4])
+
+
+def test_load_sessions_compressed():
+    pytest.importorskip('numpy')
+    from tclab import Deadband, SwingingDoor
+    values = [0, 0.05, 0, 1, 2, 3, 3, 3, 2, 1, 1, 1]
+    h = Historian([('a', lambda: values[int(h.tnow)]),
+                   ('b', lambda: values[int(h.tnow)]),
+                   ('c', lambda: h.tnow)],
+                  compression={'a': Deadband(0.1), 'b': SwingingDoor(0.1)})
+    for session in range(2):
+        for t in range(len(values)):
+            h.update(t)
+        expected = h.to_numpy(['a', 'b', 'c']).tolist()
+        h.new_session()
+    grid, data = h.load_sessions([1, 2], chunksize=5)
+    assert data[1].tolist() == expected
+    assert data[2].tolist() == expected
+
+
+def test_view_session():
+    import random
+    h = Historian([('a', lambda: (h.tnow * 10, -h.tnow)), ('b', None)])
+    for t in [0, 0, 1, 2.5, 2.5, 7, 30, 31, 250, 251.5]:
+        h.update(t)
+    view = h.view_session(1, pagewidth=10, cachesize=3)
+    assert view.columns == h.columns
+    rng = random.Random(1)
+    for _ in range(200):
+        tstart = rng.uniform(-5, 260)
+        tend = rng.choice([None, tstart, rng.uniform(-5, 260)])
+        assert view.timeslice(tstart, tend) == h.timeslice(tstart, tend)
+    assert view.at(2.6, ['b']) == h.at(2.6, ['b']) == [-2.5]
+    assert view.after(200) == h.after(200)
+    assert len(view.pages) == 3
+    reads = view.reads
+    view.after(250)
+    assert view.reads == reads
+    h.new_session()
+    h.update(0)
+    assert h.view_session(1).at(31) == [31, 310, -31]
+    assert h.view_session(2).at(31) == [0, 0, 0]
+    h.new_session()
+    assert h.view_session(3).timeslice() == [[], [], []]
+
+
+def test_view_session_recording():
+    h = Historian([('a', lambda: h.tnow * 10)])
+    for t in range(5):
+        h.update(t)
+    view = h.view_session(1, pagewidth=100)
+    assert view.after(0)[0] == [0, 1, 2, 3, 4]
+    for t in range(5, 10):
+        h.update(t)
+    assert view.at(8) == h.at(8) == [8, 80]
+    assert view.after(0) == h.after(0)
+
+
+def test_view_session_compressed():
+    from tclab import Deadband, SwingingDoor
+    values = [0, 0.05, 0, 1, 2, 3, 3, 3, 2, 1, 1, 1]
+    h = Historian([('a', lambda: values[int(h.tnow)]),
+                   ('b', lambda: values[int(h.tnow)]),
+                   ('c', lambda: h.tnow)],
+                  compression={'a': Deadband(0.1), 'b': SwingingDoor(0.1)})
+    for t in range(len(values)):
+        h.update(t)
+    h.new_session()
+    view = h.view_session(1, pagewidth=4)
+    h.load_session(1)
+    for t in [-1, 0, 1, 2.5, 3, 6.5, 11, 20]:
+        assert view.at(t) == h.at(t)
+        assert view.timeslice(t, t + 3) == h.timeslice(t, t + 3)
+    assert view.at(3) == [3, 1, 1.0, 3]
+
+
+def test_to_npy(tmpdir):
+    np = pytest.importorskip('numpy')
+    h = make_sessions(background=True)
+    outfile = str(tmpdir.join('test.npy'))
+    h.to_npy(outfile, sessions=[2, 1], chunksize=4)
+    data = np.load(outfile)
+    assert data.shape == (35, 4)
+    assert data[:10, 0].tolist() == [2] * 10
+    assert data[10:, 1].tolist() == list(range(25))
+    assert data[-1].tolist() == [1, 24, 240, -24]
+    h.to_npy(outfile)
+    assert np.load(outfile).tolist() == h.to_numpy().tolist()
+    h.close()
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_to_npz(tmpdir, monkeypatch, stream):
+    np = pytest.importorskip('numpy')
+    import tclab.export
+    monkeypatch.setattr(tclab.export, '_stream_members', stream)
+    h = make_sessions()
+    outfile = str(tmpdir.join('test.npz'))
+    h.to_npz(outfile, sessions=[1, 2], compressed=True)
+    with np.load(outfile) as data:
+        assert data['columns'].tolist() == ['Session', 'Time', 'a', 'b']
+        assert data['session1'].shape == (25, 4)
+        assert data['session2'][3].tolist() == [2, 3, 30, -3]
+    h.to_npz(outfile)
+    with np.load(outfile) as data:
+        assert data['columns'].tolist() == ['Time', 'a', 'b']
+        assert data['log'].tolist() == h.to_numpy().tolist()
+
+
+def test_timeslice():
+    h = Historian(sources=[('a', lambda: h.tnow * 10)], dbfile=None)
+    for t in range(5):
+        h.update(t)
+    assert h.timeslice(1, 3) == [[1, 2, 3], [10, 20, 30]]
+    assert h.timeslice(1.5, 2.5, ['a']) == [[10, 20]]
+
+
+def test_arrays():
+    np = pytest.importorskip('numpy')
+    h = Historian(sources=[('a', lambda: h.tnow * 10)], arrays=True)
+    for t in range(3000):
+        h.update(t)
+    assert len(h.t) == 3000
+    assert h.logdict['a'][-1] == 29990
+    assert h.at(1500.5) == [1500, 15000]
+
+    t, a = h.after(2990)
+    assert isinstance(a, np.ndarray)
+    assert np.shares_memory(a, h.logdict['a'].data)
+    assert list(t) == list(range(2990, 3000))
+    assert h.log[1] == (1, 10)
+
+    h.load_session(1)
+    assert len(h.t) == 3000
+    assert h.at(10, ['a']) == [100]
+
+
+def test_ring_buffer():
+    pytest.importorskip('numpy')
+    h = Historian(sources=[('a', lambda: h.tnow * 10)], capacity=100)
+    for t in range(1050):
+        h.update(t)
+    assert len(h.t) == 100
+    assert h.t[0] == 950 and h.t[-1] == 1049
+    assert list(h.after(1040)[0]) == list(range(1040, 1050))
+    assert h.at(0) == [950, 9500]
+    assert h.to_numpy().shape == (100, 2)
+    assert len(h.db.get('a')) == 1050
+
+
+def test_interp():
+    pytest.importorskip('numpy')
+    h = Historian(sources=[('a', lambda: (h.tnow * 10,
+                                          'x{}'.format(h.tnow))),
+                           ('b', None)], dbfile=None)
+    for t in range(0, 10, 2):
+        h.update(t)
+    times = [-1, 0, 1, 3.5, 8, 20]
+    t, a, b = h.at(times)
+    assert t.tolist() == [0, 0, 0, 2, 8, 8]
+    assert a.tolist() == [0, 0, 0, 20, 80, 80]
+    assert b.tolist() == ['x0', 'x0', 'x0', 'x2', 'x8', 'x8']
+    assert [h.at(x, ['a']) for x in times] == [[v] for v in a]
+    a, = h.interp(times, ['a'], method='linear')
+    assert a.tolist() == [0, 0, 10, 35, 80, 80]
+    with pytest.raises(ValueError):
+        h.interp(times, method='cubic')
+
+
+def test_interp_compressed():
+    np = pytest.importorskip('numpy')
+    from tclab import SwingingDoor
+    values = [0, 1, 2, 3, 3, 3, 3, 0]
+    for arrays in [False, True]:
+        h = Historian([('a', lambda: values[int(h.tnow)])], dbfile=None,
+                      arrays=arrays, compression={'a': SwingingDoor(0.1)})
+        for t in range(8):
+            h.update(t)
+        times = np.arange(-1, 9, 0.5)
+        a, = h.interp(times, ['a'])
+        assert a.tolist() == [h.at(x, ['a'])[0] for x in times]
+        a, = h.interp(times, ['a'], method='linear')
+        assert a.tolist() == np.interp(times, range(8), values).tolist()
+
+
+def test_compressed_reload():
+    import random
+    from tclab import SwingingDoor
+    random.seed(1)
+    values = [0]
+    for _ in range(199):
+        values.append(values[-1] + random.gauss(0, 0.2))
+    h = Historian([('a', lambda: values[int(h.tnow)])],
+                  compression={'a': SwingingDoor(0.1)})
+    for t in range(200):
+        h.update(t)
+    h.new_session()
+    h.load_session(1)
+    assert len(h.t) < 200
+    for t in range(200):
+        assert abs(h.at(t, ['a'])[0] - values[t]) <= 0.1 + 1e-9
+    assert h.at(-5, ['a']) == [values[0]]
+
+
+def test_subscribe():
+    import threading
+    h = Historian([('a', lambda: (h.tnow, -h.tnow)), ('b', None)],
+                  dbfile=None)
+    rows = []
+    callback = h.subscribe(rows.append, ['Time', 'b'])
+    buffered = h.subscribe(maxlen=3)
+    received = []
+    reader = h.subscribe()
+    thread = threading.Thread(target=lambda: received.extend(reader))
+    thread.start()
+    for t in range(5):
+        h.update(t)
+    reader.close()
+    thread.join(5)
+    assert rows == [(t, -t) for t in range(5)]
+    assert buffered.drain() == [(t, t, -t) for t in range(2, 5)]
+    assert buffered.dropped == 2 and buffered.delivered == 5
+    assert received == h.log
+    callback.close()
+    h.update(5)
+    assert len(rows) == 5
+    assert h.subscriptions == [buffered]
+
+
+def test_subscribe_close_errors():
+    import threading
+    h = Historian([('a', lambda: h.tnow)], dbfile=None)
+
+    def broken(row):
+        raise RuntimeError('broken consumer')
+
+    failing = h.subscribe(broken)
+    other = h.subscribe()
+    received = []
+    reader = h.subscribe()
+    thread = threading.Thread(target=lambda: received.extend(reader))
+    thread.daemon = True
+    thread.start()
+    h.update(0)
+    h.update(1)
+    assert failing.errors == 2
+    assert isinstance(failing.error, RuntimeError)
+    assert other.drain() == [(0, 0), (1, 1)]
+    h.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert received == [(0, 0), (1, 1)]
+    assert other.closed and h.subscriptions == []
+
+
+def test_parallel():
+    import threading
+    import time
+    release = threading.Event()
+
+    def slow(value, delay):
+        def valuefunction():
+            time.sleep(delay)
+            return value
+        return valuefunction
+
+    def stuck():
+        release.wait(5)
+        return 3
+
+    h = Historian([('a', slow(1, 0.2)), ('b', slow((2, 3), 0.2)), ('c', None)],
+                  dbfile=None, parallel=True)
+    start = time.time()
+    h.update(0)
+    assert time.time() - start < 0.35
+    assert h.log == [(0, 1, 2, 3)]
+    assert set(h.acquisition) == {'a', 'b', 'c'}
+    h.close()
+
+    calls = []
+    h = Historian([('a', lambda: 1), ('b', lambda: calls.append(1) or stuck())],
+                  dbfile=None, parallel=True, timeout=0.05)
+    h.update(0)
+    # the call started at 0 returns during update 1, but is not logged at 1
+    timer = threading.Timer(0.02, release.set)
+    timer.start()
+    h.update(1)
+    timer.join()
+    assert h.log == [(0, 1, None), (1, 1, None)]
+    assert h.timeouts == {'a': 0, 'b': 2}
+    assert h.acquisition['b'] is None
+    assert len(calls) == 1
+    time.sleep(0.05)
+    h.update(2)
+    assert h.log[-1] == (2, 1, 3)
+    assert len(calls) == 2
+    h.close()
+    with pytest.raises(ValueError):
+        Historian([('a', lambda: 1)], timeout=1)
+
+
+def test_timestamps():
+    from tclab import Labtime
+    lt = Labtime(virtual=True)
+
+    def slow():
+        lt.sleep(0.5)
+        return 1, 2
+
+    h = Historian([('a', slow), ('b', None), ('c', lambda: 3)],
+                  labtime=lt, timestamps=True)
+    assert h.columns == ['Time', 'a', 'b', 'c', 'a.start', 'a.end',
+                         'c.start', 'c.end']
+    h.update()
+    h.update()
+    assert h.log[1] == (0.5, 1, 2, 3, 0.5, 1.0, 1.0, 1.0)
+    assert h.acquisition == {'a': 1.0, 'b': 1.0, 'c': 1.0}
+    assert h.db.get('a.end') == [(0, 0.5), (0.5, 1.0)]
+    statistics = h.latency_statistics()
+    assert statistics['a']['calls'] == 2
+    assert statistics['c']['max'] >= statistics['c']['mean'] >= 0
+    assert set(statistics) == {'a', 'c'}
+
+
+def test_to_numpy():
+    pytest.importorskip('numpy')
+    h = Historian(sources=[('a', lambda: (1, 2)), ('b', None)])
+    h.update(0)
+    h.update(1)
+    assert h.to_numpy().tolist() == [[0, 1, 2], [1, 1, 2]]
+    assert h.to_numpy(['b']).tolist() == [[2], [2]]
+
+
+def test_to_pandas():
+    pytest.importorskip('pandas')
+    h = Historian(sources=[('a', lambda: (1, 2)), ('b', None)], arrays=True)
+    h.update(0)
+    h.update(1)
+    frame = h.to_pandas()
+    assert list(frame.columns) == ['a', 'b']
+    assert list(frame.index) == [0, 1]
+
+
+def test_compression():
+    from tclab import Deadband, SwingingDoor
+    values = [20 + 0.01 * (t % 3) for t in range(50)] + list(range(50))
+    h = Historian([('a', lambda: (values[int(h.tnow)], h.tnow)),
+                   ('b', None),
+                   ('c', lambda: values[int(h.tnow)])],
+                  compression={'a': Deadband(0.1), 'c': SwingingDoor(0.1)})
+    for t in range(100):
+        h.update(t)
+    a, c = h.logdict['a'], h.logdict['c']
+    assert len(a.archivetimes) == 51
+    assert len(c.archivetimes) == 3
+    assert all(abs(x - v) <= 0.1 for x, v in zip(c, values))
+    assert h.at(30, ['Time', 'a']) == [30, 20]
+    h.new_session()
+    assert h.db.get('c', session=1) == [(0, 20), (49, 20.01), (50, 0),
+                                        (99, 49)]
+    assert len(h.db.get('b', session=1)) == 100
+    h.load_session(1)
+    assert h.logdict['a'][:] == a[:]
+    assert h.logdict['c'][:] == c[:]
+    with pytest.raises(ValueError):
+        Historian([('a', None)], compression={'x': Deadband(1)})
+
+
+def test_background():
+    h = Historian(sources=[('a', lambda: h.tnow * 10)], background=True)
+    for t in range(100):
+        h.update(t)
+    assert h.get_sessions()[0][2] == 100
+    metrics = h.db.metrics()
+    assert metrics['written'] == 100
+    assert metrics['depth'] == 0
+    assert metrics['dropped'] == metrics['spilled'] == 0
+
+    h.new_session()
+    assert h.session == 2
+    h.update(0)
+    h.load_session(1)
+    assert h.at(50) == [50, 500]
+    h.close()
+
+
+def test_background_file(tmpdir):
+    from tclab.historian import TagDB
+    dbfile = str(tmpdir.join('test.db'))
+    h = Historian(sources=[('a', lambda: 1)], dbfile=dbfile, background=True)
+    for t in range(10):
+        h.update(t)
+    h.close()
+    assert len(TagDB(dbfile).get('a', session=1)) == 10
+
+
+def test_background_readers(tmpdir):
+    import threading
+    h = Historian(sources=[('a', lambda: 1)], dbfile=str(tmpdir.join('r.db')),
+                  background=True, readers=2)
+    for t in range(10):
+        h.update(t)
+    h.new_session()
+    # queries of the finished session do not wait for a busy writer
+    gate = threading.Event()
+    thread = threading.Thread(target=h.db.call, args=(gate.wait,))
+    thread.start()
+    try:
+        assert len(h.db.get('a', session=1)) == 10
+        assert h.db.session_summary(1)['rows'] == 10
+    finally:
+        gate.set()
+        thread.join()
+    h.close()
+
+
+@pytest.mark.parametrize("overflow", ['drop', 'spill', 'block'])
+def test_background_overflow(overflow):
+    import threading
+    from tclab.historian import BackgroundWriter
+    writer = BackgroundWriter(queuesize=5, overflow=overflow)
+    writer.new_session()
+    busy = threading.Event()
+    release = threading.Event()
+
+    def stall():
+        busy.set()
+        release.wait()
+
+    blocked = threading.Thread(target=writer.call, args=(stall,))
+    blocked.start()
+    busy.wait()
+
+    recorder = threading.Thread(
+        target=lambda: [writer.record_row(t, ['a'], [t]) for t in range(8)])
+    recorder.start()
+    try:
+        recorder.join(0.5)
+        metrics = writer.metrics()
+        if overflow == 'block':
+            assert recorder.is_alive()
+            assert metrics['depth'] == 5
+        else:
+            assert not recorder.is_alive()
+    finally:
+        release.set()
+        recorder.join()
+        blocked.join()
+
+    values = [v for t, v in writer.get('a')]
+    metrics = writer.metrics()
+    if overflow == 'drop':
+        assert metrics['dropped'] == 3
+        assert values == [3, 4, 5, 6, 7]
+    else:
+        assert values == list(range(8))
+        assert metrics['written'] == 8
+    if overflow == 'spill':
+        assert metrics['spilled'] == 3
+        assert metrics['maxdepth'] == 5
+    writer.close()
+
+
+def test_background_spill_order():
+    import threading
+    import time
+    from tclab.historian import BackgroundWriter
+    writer = BackgroundWriter(queuesize=2, overflow='spill')
+    writer.new_session()
+    started = threading.Event()
+    release = threading.Event()
+    blocked = threading.Thread(
+        target=writer.call, args=(lambda: started.set() or release.wait(),))
+    blocked.start()
+    # the rows must be queued while the writer thread is busy
+    started.wait()
+    for t in range(5):
+        writer.record_row(t, ['a'], [t])
+    counted = []
+    counter = threading.Thread(
+        target=lambda: counted.append(writer.call(
+            lambda: len(writer.tagdb.get('a')))))
+    counter.start()
+    while not writer.items or writer.items[-1][0] != 'call':
+        time.sleep(0.01)
+    for t in range(5, 8):
+        writer.record_row(t, ['a'], [t])
+    release.set()
+    counter.join()
+    blocked.join()
+    assert counted == [5]
+    assert [v for t, v in writer.get('a')] == list(range(8))
+    assert writer.metrics()['maxdepth'] == 2
+    assert writer.spillread == 0
+    writer.close()
+
+
+def test_background_errors():
+    from tclab.historian import BackgroundWriter
+    with pytest.raises(ValueError):
+        BackgroundWriter(overflow='explode')
+    writer = BackgroundWriter()
+    with pytest.raises(KeyError):
+        writer.session_summary(10)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.record_row(0, ['a'], [1])
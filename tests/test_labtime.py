@@ -1,7 +1,7 @@
 import pytest
 import time
 
-from tclab import labtime, clock, setnow
+from tclab import labtime, clock, setnow, Labtime
 
 
 def test_import():
@@ -136,3 +136,120 @@ def test_sync(rate):
         if 0.5 < t < 2.5:
             labtime.sleep(1.1)
     assert round(t) == 5.0
+
+
+def test_virtual():
+    labtime.set_virtual()
+    try:
+        assert labtime.virtual
+        tic = labtime.time()
+        time.sleep(0.1)
+        assert labtime.time() == tic
+        realtic = time.time()
+        labtime.sleep(3600)
+        assert time.time() - realtic < 0.1
+        assert labtime.time() == tic + 3600
+    finally:
+        labtime.set_virtual(False)
+    assert not labtime.virtual
+
+
+@pytest.mark.parametrize("step", [1, 2])
+def test_virtual_clock(step):
+    labtime.set_virtual()
+    try:
+        tic = time.time()
+        times = list(clock(7200, step))
+        assert time.time() - tic < 10
+    finally:
+        labtime.set_virtual(False)
+    assert times == [step * i for i in range(7200 // step + 1)]
+
+
+def test_virtual_clock_fractional_step():
+    labtime.set_virtual()
+    try:
+        times = list(clock(100, 0.1))
+    finally:
+        labtime.set_virtual(False)
+    assert all(b - a > 0.05 for a, b in zip(times, times[1:]))
+
+
+def test_instances_are_independent():
+    labtime.set_rate(1)
+    a = Labtime()
+    b = Labtime(virtual=True)
+    a.set_rate(2)
+    b.sleep(100)
+    assert labtime.get_rate() == 1
+    assert b.time() == 100
+    assert not labtime.virtual
+    assert a.time() < 1
+
+
+def test_instance_clock():
+    lt = Labtime(virtual=True)
+    assert list(lt.clock(5)) == [0, 1, 2, 3, 4, 5]
+    assert lt.time() == 5
+
+
+class LateLabtime(Labtime):
+    """Virtual labtime which oversleeps by the given amounts"""
+    def __init__(self, extra):
+        Labtime.__init__(self, virtual=True)
+        self.extra = list(extra)
+
+    def sleep(self, delay):
+        Labtime.sleep(self, delay + self.extra.pop(0))
+
+
+def test_clock_statistics():
+    lt = LateLabtime([0.01, 0.04, 0, 0.03])
+    c = lt.clock(4)
+    assert [round(t) for t in c] == [0, 1, 2, 3, 4]
+    stats = c.statistics()
+    assert stats['ticks'] == 4
+    assert stats['overruns'] == 0
+    assert stats['mean'] == pytest.approx(0.02)
+    assert stats['p99'] == stats['max'] == pytest.approx(0.04)
+    # the spinning wait of a real-time clock also records its ticks
+    lt = Labtime()
+    lt.set_rate(4)
+    c = lt.clock(2, adaptive=False, spin=0.005)
+    assert round(list(c)[-1]) == 2
+    stats = c.statistics()
+    assert stats['ticks'] == 2
+    assert 0 <= stats['mean'] <= stats['p99'] <= stats['max']
+
+
+def test_clock_overruns():
+    lt = Labtime(virtual=True)
+    c = lt.clock(10)
+    for t in c:
+        if t == 3:
+            lt.sleep(2.5)
+    assert c.statistics()['overruns'] == 1
+    assert len(c.lateness) == 8
+
+
+def test_adaptive_speedup():
+    lt = Labtime()
+    lt.set_rate(2)
+    c = lt.clock(300)
+    for t in c:
+        time.sleep(0.001)
+    assert c.speedup > 50
+    assert lt.get_rate() > 100
+    assert c.statistics()['speedup'] > 50
+    assert c.cost == pytest.approx(0.001, rel=1)
+
+
+def test_adaptive_slows_down():
+    lt = Labtime()
+    lt.set_rate(10)
+    c = lt.clock(10, slack=0.5)
+    for t in c:
+        time.sleep(0.2)
+    assert lt.get_rate() < 5
+    with pytest.raises(ValueError):
+        lt.clock(10, slack=1)
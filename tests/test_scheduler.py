@@ -0,0 +1,59 @@
+import pytest
+
+from tclab import Labtime, Scheduler
+
+
+@pytest.fixture()
+def labtime():
+    return Labtime(virtual=True)
+
+
+def test_multirate(labtime):
+    calls = {'sample': [], 'control': [], 'flush': []}
+    scheduler = Scheduler(labtime)
+    scheduler.add(calls['sample'].append, 0.1, priority=2)
+    scheduler.add(calls['control'].append, 1, priority=1)
+    scheduler.add(calls['flush'].append, 5, phase=0.5)
+    scheduler.run(10)
+
+    assert len(calls['sample']) == 101
+    assert calls['control'] == list(range(11))
+    assert calls['flush'] == [0.5, 5.5]
+    assert labtime.time() == pytest.approx(10)
+
+
+def test_priority_order(labtime):
+    order = []
+    scheduler = Scheduler(labtime)
+    scheduler.add(lambda t: order.append('low'), 1, priority=0)
+    scheduler.add(lambda t: order.append('high'), 1, priority=5)
+    scheduler.run(0)
+    assert order == ['high', 'low']
+
+
+def test_shedding(labtime):
+    scheduler = Scheduler(labtime)
+    slow = scheduler.add(lambda t: labtime.sleep(0.15), 1, priority=2)
+    sample = scheduler.add(lambda t: None, 0.1, priority=1)
+    plot = scheduler.add(lambda t: None, 1, priority=0)
+    scheduler.run(5)
+
+    assert slow.runs == 6
+    assert plot.shed == 6 and plot.runs == 0
+    assert sample.shed == 6 and sample.runs == 45
+    assert scheduler.overruns == 6
+
+
+def test_task_validation(labtime):
+    with pytest.raises(ValueError):
+        Scheduler(labtime).add(lambda t: None, 0)
+
+
+def test_missed_ticks(labtime):
+    scheduler = Scheduler(labtime)
+    scheduler.add(lambda t: labtime.sleep(0.35), 1)
+    sample = scheduler.add(lambda t: None, 0.1)
+    scheduler.run(5)
+
+    assert sample.missed == 10
+    assert sample.runs + sample.missed == 51
@@ -18,3 +18,12 @@ def test_connected_error():
         setup(connected=False, speedup=0)
     with pytest.raises(ValueError):
         setup(connected=False, speedup=-1)
+
+
+def test_setup_labtime():
+    from tclab import labtime, Labtime
+    lt = Labtime()
+    rate = labtime.get_rate()
+    assert TCLabModel == setup(connected=False, speedup=5, labtime=lt)
+    assert lt.get_rate() == 5
+    assert labtime.get_rate() == rate
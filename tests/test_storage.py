@@ -0,0 +1,166 @@
+import pytest
+
+from tclab.historian import Historian, TagDB
+from tclab.storage import MemoryStorage, BinaryStorage
+
+
+@pytest.fixture(params=['tagdb', 'memory', 'binary'])
+def storage(request, tmpdir):
+    if request.param == 'tagdb':
+        return TagDB()
+    if request.param == 'memory':
+        return MemoryStorage()
+    pytest.importorskip('numpy')
+    return BinaryStorage(str(tmpdir.join('sessions')))
+
+
+def record(storage, n, session=True):
+    if session:
+        storage.new_session()
+    for t in range(n):
+        storage.record_row(t, ['a', 'b'], [10 * t, None if t % 2 else -t])
+
+
+def test_sessions(storage):
+    record(storage, 5)
+    record(storage, 3)
+    sessions = storage.get_sessions()
+    assert [s[0] for s in sessions] == [1, 2]
+    assert [s[2] for s in sessions] == [5, 3]
+    summary = storage.session_summary(1)
+    assert summary['rows'] == 5
+    assert summary['tfirst'] == 0
+    assert summary['duration'] == 4
+    assert summary['tags'] == ['a', 'b']
+    with pytest.raises(KeyError):
+        storage.session_summary(7)
+
+
+def test_get_session(storage):
+    record(storage, 5)
+    assert storage.get_session(['b', 'a']) == [
+        (0, 0, 0), (1, None, 10), (2, -2, 20), (3, None, 30), (4, -4, 40)]
+    assert storage.get_session(['a'], 1, 1, 3) == [(1, 10), (2, 20)]
+    assert storage.get_session(['missing'], 1, 3) == [(3, None), (4, None)]
+    assert storage.get('b') == [(0, 0), (2, -2), (4, -4)]
+    assert storage.last_time(2.5) == 2
+    assert storage.last_time(-1) is None
+
+
+def test_out_of_order(storage):
+    storage.new_session()
+    for t in [2, 0, 1]:
+        storage.record_row(t, ['a'], [t])
+    assert storage.get_session(['a']) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_chunks(storage):
+    record(storage, 5)
+    record(storage, 3)
+    chunks = list(storage.iter_session(['a'], 1, chunksize=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    rows = [row for chunk in storage.iter_sessions(['a'], [1, 2], 3)
+            for row in chunk]
+    assert rows == ([(1, t, 10 * t) for t in range(5)]
+                    + [(2, t, 10 * t) for t in range(3)])
+
+
+def test_downsample(storage):
+    record(storage, 5)
+    assert storage.downsample('a', 2) == [(0, 0, 10, 5, 0, 10, 2),
+                                          (2, 20, 30, 25, 20, 30, 2),
+                                          (4, 40, 40, 40, 40, 40, 1)]
+
+
+def test_delete_session(storage):
+    record(storage, 5)
+    record(storage, 3)
+    storage.delete_session(1)
+    assert [s[0] for s in storage.get_sessions()] == [2]
+
+
+def test_binary_reopen(tmpdir):
+    pytest.importorskip('numpy')
+    directory = str(tmpdir.join('sessions'))
+    storage = BinaryStorage(directory)
+    record(storage, 5)
+    storage.close()
+    storage = BinaryStorage(directory)
+    assert storage.get_sessions()[0][2] == 5
+    assert storage.get_session(['a'], 1)[-1] == (4, 40)
+    storage.new_session()
+    assert storage.session == 2
+    with pytest.raises(ValueError):
+        storage.record_row(0, ['a', 'b'], [1, 2])
+        storage.record_row(1, ['c'], [3])
+
+
+@pytest.mark.parametrize('backend', ['memory', 'binary'])
+def test_historian_storage(backend, tmpdir):
+    if backend == 'memory':
+        storage = MemoryStorage()
+    else:
+        pytest.importorskip('numpy')
+        storage = BinaryStorage(str(tmpdir.join('sessions')))
+    a = [0]
+    h = Historian([('a', lambda: a[0])], storage=storage)
+    for t in range(3):
+        a[0] = 2 * t
+        h.update(t)
+    h.new_session()
+    h.update(0)
+    h.load_session(1)
+    assert h.log == [(0, 0), (1, 2), (2, 4)]
+    assert h.session_summary(1)['rows'] == 3
+    with pytest.raises(ValueError):
+        Historian([('a', lambda: 1)], storage=storage, background=True)
+
+
+def test_session_file(tmpdir):
+    np = pytest.importorskip('numpy')
+    from tclab.sessionfile import SessionFile
+    filename = str(tmpdir.join('session.tcs'))
+    writer = SessionFile.create(filename, ['Time', 'a'], 'now')
+    with pytest.raises(ValueError):
+        SessionFile.create(filename, ['Time'])
+    reader = SessionFile(filename)
+    assert reader.columns == ['Time', 'a']
+    assert reader.array().shape == (0, 2)
+    writer.extend([(0, 1), (1, None)])
+    writer.flush()
+    data = reader.array()
+    assert data[0].tolist() == [0, 1]
+    assert np.isnan(data[1, 1])
+    writer.file.write(b'\0' * 4)
+    writer.flush()
+    assert reader.nrows == 2
+    writer.close()
+    with open(str(tmpdir.join('other')), 'wb') as f:
+        f.write(b'not a session file')
+    with pytest.raises(ValueError):
+        SessionFile(str(tmpdir.join('other')))
+
+
+def test_load_session_maps_file(tmpdir):
+    np = pytest.importorskip('numpy')
+    storage = BinaryStorage(str(tmpdir.join('sessions')))
+    h = Historian([('a', lambda: 1), ('b', lambda: 2)], storage=storage,
+                  arrays=True)
+    for t in range(5):
+        h.update(t)
+    h.new_session()
+    h.update(0)
+    h.load_session(1)
+    assert isinstance(h.fields[1][:].base, np.memmap)
+    assert h.log[-1] == (4, 1, 2)
+    assert h.at(2.5) == [2, 1, 2]
+
+
+def test_events(storage):
+    storage.new_session()
+    storage.record_event(2, 'T1 high', True, 61.5)
+    storage.record_event(1, 'T1 invalid', True)
+    storage.new_session()
+    assert storage.get_events(1) == [(1, 'T1 invalid', True, None),
+                                     (2, 'T1 high', True, 61.5)]
+    assert storage.get_events() == []
@@ -1,6 +1,6 @@
 import pytest
 
-from tclab.historian import TagDB
+from tclab.tagdb import TagDB
 
 
 @pytest.fixture()
@@ -34,3 +34,228 @@ def test_get_sessions(db):
     assert len(sessions) == 2
     assert sessions[0][0] == 1
     assert sessions[1][0] == 2
+
+
+def test_buffered_record(tmpdir):
+    filename = str(tmpdir.join('test.db'))
+    db = TagDB(filename, buffersize=3, flushinterval=60)
+    db.record_row(0, ["Test"], [1])
+    db.record_row(1, ["Test"], [2])
+    assert db.buffer
+
+    other = TagDB(filename)
+    assert other.get("Test", session=db.session) == []
+    db.record_row(2, ["Test"], [3])
+    assert not db.buffer
+    assert len(other.get("Test", session=db.session)) == 3
+
+    db.record(3, "Test", 4)
+    db.close()
+    assert len(other.get("Test", session=db.session)) == 4
+
+
+def test_read_flushes(db):
+    db.record(0, "Test", 1)
+    assert db.get("Test") == [(0, 1)]
+    assert not db.buffer
+
+
+def test_wal(tmpdir):
+    db = TagDB(str(tmpdir.join('test.db')))
+    assert db.cursor.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_events_index(db):
+    plan = db.cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM events '
+                             'WHERE session_id = 1 ORDER BY timeseconds')
+    assert 'events_session_time' in ' '.join(str(row) for row in plan)
+
+
+def test_pragma_validation():
+    with pytest.raises(ValueError):
+        TagDB(synchronous='sometimes')
+    with pytest.raises(ValueError):
+        TagDB(journal_mode='WAL; DROP TABLE tagvalues')
+
+
+def test_record_combines_rows(db):
+    db.record(0, "a", 1)
+    db.record(0, "b", 2)
+    db.record(1, "a", 3)
+    assert db.get_session(["a", "b", "c"]) == [(0, 1, 2, None),
+                                               (1, 3, None, None)]
+    assert db.get("b") == [(0, 2)]
+
+
+def test_record_row(db):
+    db.record_row(0, ["a", "b"], [1, 2])
+    db.record_row(1, ["b", "a"], [3, 4])
+    assert db.get_session(["a", "b"]) == [(0, 1, 2), (1, 4, 3)]
+    assert db.get("a", timeseconds=1) == [(1, 4)]
+    assert db.get("unknown") == []
+
+
+def test_tag_names(db):
+    db.record_row(0, ["T1", "t1", 'quote"d', "timeseconds"], [1, 2, 3, 4])
+    assert db.get_session(["T1", "t1", 'quote"d', "timeseconds"]) == [
+        (0, 1, 2, 3, 4)]
+
+
+def test_migrate(tmpdir):
+    import sqlite3
+    filename = str(tmpdir.join('old.db'))
+    old = sqlite3.connect(filename)
+    old.execute("""CREATE TABLE tagvalues (
+                       session_id REFERENCES session (id),
+                       timeseconds, name, value)""")
+    old.execute("CREATE TABLE sessions (id INTEGER PRIMARY KEY, starttime)")
+    old.execute("INSERT INTO sessions VALUES (1, datetime('now'))")
+    old.executemany("INSERT INTO tagvalues VALUES (1, ?, ?, ?)",
+                    [(0, 'T1', 20.0), (0, 'T2', 21.0),
+                     (1, 'T1', 22.0), (1, 'T2', 23.0)])
+    old.commit()
+    old.close()
+
+    db = TagDB(filename)
+    assert db.get_session(['T1', 'T2'], session=1) == [(0, 20.0, 21.0),
+                                                       (1, 22.0, 23.0)]
+    assert db.get('T2', session=1) == [(0, 21.0), (1, 23.0)]
+    assert db.get_sessions()[0][2] == 2
+    assert db.session_summary(1)['tags'] == ['T1', 'T2']
+    assert not db._hastable('tagvalues')
+    db.close()
+
+
+def test_session_summary(db):
+    db.new_session()
+    db.record_row(1, ["a"], [1])
+    db.record_row(2, ["a", "b"], [2, 3])
+    db.flush()
+    db.record_row(5, ["c"], [4])
+    summary = db.session_summary()
+    assert summary['rows'] == 3
+    assert summary['tfirst'] == 1 and summary['tlast'] == 5
+    assert summary['duration'] == 4
+    assert summary['tags'] == ['a', 'b', 'c']
+    assert db.get_sessions()[-1][2] == 3
+
+    db.new_session()
+    assert db.session_summary()['rows'] == 0
+    db.clean()
+    assert len(db.get_sessions()) == 1
+    with pytest.raises(KeyError):
+        db.session_summary(100)
+
+
+def test_summarise(db):
+    db.record_row(1, ["a"], [1])
+    db.record_row(2, ["b"], [2])
+    expected = db.session_summary()
+    db.cursor.execute("UPDATE sessions SET nrows=0, tags='[]'")
+    db.summarise()
+    assert db.session_summary() == expected
+
+
+def test_delete_session(db):
+    db.record_row(1, ["a"], [1])
+    first = db.session
+    db.new_session()
+    db.record_row(1, ["a"], [2])
+    db.delete_session(first)
+    assert [s[0] for s in db.get_sessions()] == [db.session]
+    assert db.get("a", session=first) == []
+    plan = db.cursor.execute("EXPLAIN QUERY PLAN DELETE FROM samples "
+                             "WHERE session_id = 1").fetchall()
+    assert 'samples_session_time' in str(plan)
+
+
+def test_get_chunk(db):
+    for t in [3, 1, 2, 2, 0]:
+        db.record_row(t, ["a"], [t])
+    rows, after = db.get_chunk(["a", "b"], size=3)
+    assert rows == [(0, 0, None), (1, 1, None), (2, 2, None)]
+    rows, after = db.get_chunk(["a"], after=after, size=3)
+    assert rows == [(2, 2), (3, 3)]
+    assert db.get_chunk(["a"], after=after) == ([], after)
+    assert list(db.iter_session(["a"], chunksize=2)) == [
+        [(0, 0), (1, 1)], [(2, 2), (2, 2)], [(3, 3)]]
+
+
+def test_downsample(db):
+    for t in range(-3, 10):
+        db.record_row(t, ["a", "b"], [t * t, None if t % 2 else t])
+    assert db.downsample("a", 5) == [(-5, 1, 9, 14 / 3, 9, 1, 3),
+                                     (0, 0, 16, 6.0, 0, 16, 5),
+                                     (5, 25, 81, 51.0, 25, 81, 5)]
+    assert db.downsample("b", 5, tstart=0, tend=5) == [
+        (0, 0, 4, 2.0, 0, 4, 3)]
+    assert db.downsample("c", 5) == []
+
+
+def test_rollups(tmpdir):
+    filename = str(tmpdir.join('rollups.db'))
+    db = TagDB(filename)
+    for t in range(-3, 30):
+        db.record_row(t / 2, ["a"], [t % 7])
+    session = db.session
+    expected = db.downsample("a", 2)
+    db.close()
+    db = TagDB(filename, rollups=[2, 4])
+    assert db.rollups == [2, 4]
+    assert db.downsample("a", 2, session=session) == expected
+    assert db.downsample("a", 2, 2, 8, session) == expected[2:5]
+    for t in range(30, 60):
+        db.record_row(t / 2, ["a"], [t % 7])
+    db.flush()
+    db.record_row(1, ["a"], [5])
+    rollup = db.downsample("a", 4)
+    db.rollups = []
+    assert db.downsample("a", 4) == rollup
+    db.close()
+    assert TagDB(filename).rollups == [2, 4]
+    with pytest.raises(ValueError):
+        TagDB(rollups=[0])
+
+
+def test_readers(tmpdir):
+    import threading
+    with pytest.raises(ValueError):
+        TagDB(readers=2)
+    db = TagDB(str(tmpdir.join('readers.db')), readers=2)
+    errors = []
+    counts = []
+
+    def read():
+        try:
+            for _ in range(20):
+                counts.append(len(db.get("a")))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for t in range(200):
+        db.record_row(t, ["a"], [t])
+    for thread in threads:
+        thread.join()
+    assert errors == [] and len(counts) == 80
+    # buffered rows are written before reading
+    db.record_row(200, ["a"], [200])
+    assert db.get("a")[-1] == (200, 200)
+    thread = threading.Thread(target=lambda: counts.append(len(db.get("a"))))
+    thread.start()
+    thread.join()
+    assert counts[-1] == 201
+    assert len(db.pool) <= 2
+    # earlier sessions are read without waiting for the writer
+    db.new_session()
+    db.record_row(0, ["a"], [0])
+    with db.lock:
+        thread = threading.Thread(
+            target=lambda: counts.append(len(db.get("a", session=1))))
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+    assert counts[-1] == 201
+    db.close()